@@ -5,23 +5,55 @@ Extract audio features to build ERB bands per project and equalize them accordin
 
 # Imports
 import sys
+import json
 import clingo
 import argparse
 import textwrap
 import random
 import datetime
+import time
 import os
-import wave
-import contextlib
+import threading
 from classes import erb
 from classes import audio_features as af
 from classes import csd
-#from classes.count_propagator import Propagator
+from classes.cache import AnalysisCache
+from classes.manifest import ProjectManifest
+from classes.masking import MaskingIndex
+from classes import decompose
+from classes.observer import ProgramSizeObserver
+from classes.profiler import StageTimer
+from classes.stats import solve_statistics
+from classes.count_propagator import Propagator, sample
+
+## Available encodings
+ENCODINGS = {"default": "lp/eq.lp",
+             "optimized": "lp/eq_opt.lp"}
+## Minimal intervention objective
+MINIMIZE = "lp/minimize.lp"
+
+"""
+Comma separated list of floats, e.g. 0.2,0.3,0.5
+"""
+def float_list(value):
+    return [float(v) for v in value.split(",")]
+
+"""
+Seconds, with an optional s suffix, e.g. 30s
+"""
+def seconds(value):
+    return float(value[:-1] if value.endswith("s") else value)
+
+"""
+Comma separated list of ints, e.g. 20,40,80
+"""
+def int_list(value):
+    return [int(v) for v in value.split(",")]
 
 """ 
-Parse Arguments 
+Parse Arguments (default: command line)
 """
-def parse_params():
+def parse_params(argv=None):
     parser = argparse.ArgumentParser(prog='aspeq.py',
                                      formatter_class=argparse.RawTextHelpFormatter,
                                      description=textwrap.dedent('''\
@@ -38,19 +70,88 @@ Get help/report bugs via : flavio.everardo@cs.uni-potsdam.de
     basic_args = parser.add_argument_group("Basic Options")
 
     parser.add_argument("--benchmarks", action='store_true', default=False,
-                        help="Generate benchmarks only, no grounding or solving calls.")
+                        help="Generate benchmarks only, no grounding or solving calls.\nA self-contained instance per masking factor is written to projects/<name>/benchmarks.")
     parser.add_argument("--analyze", action='store_true', default=True,
                         help="Extract audio features. If false, aspeq uses the already calculated instances.")
+    parser.add_argument("--no-analyze", dest='analyze', action='store_false',
+                        help="Do not extract audio features, use the already calculated instances.")
+    parser.add_argument("--export-instances", action='store_true', default=False,
+                        help="Write the instance of each track to projects/<name>/<track>.lp. The facts are always passed to clingo in memory.")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Number of processes used to analyze the tracks. Default: 1. 0 = all cores")
+    parser.add_argument("--cache-size", type=int, default=512,
+                        help="Size in MB of the analysis cache stored in projects/<name>/.cache. Default: 512. 0 = cache off")
     parser.add_argument("--mixes", type=int, default=1,
                         help="Number of desired answers/mixes. Default=1")
-    parser.add_argument("--masking-factor", type=float, default=0.5,
-                        help="Define the masking factor (0-1). Default: 0.5.")
+    parser.add_argument("--masking-factor", type=float_list, default=[0.5],
+                        help="Define the masking factor (0-1). Default: 0.5.\nA comma separated list (e.g. 0.2,0.3,0.5) sweeps all the factors over a single grounding.")
     parser.add_argument("--project", type=str, default="demo",
                         help="Name of the project where all the stems are stored.")
     parser.add_argument("--samples", type=int, default=32768,
                         help="FFT size or number of samples (1000-32768). Default: 32768.")
-    parser.add_argument("--erb", type=int, default=40,
-                        help="Number of ERB bands (10-100). Default: 40.")
+    parser.add_argument("--erb", type=int_list, default=[40],
+                        help="Number of ERB bands (10-100). Default: 40.\nA comma separated list (e.g. 20,40,80) derives every resolution from a single STFT of each track,\nwith its own instances and results.")
+    parser.add_argument("--channels", type=str, default="mid", choices=["mid", "side", "left", "right", "max"],
+                        help='''\
+Channels of the stems used in the analysis:
+mid: average of the channels (default)
+side: half the difference of left and right
+left, right: a single channel
+max: every channel analyzed on its own, the spectrum is their maximum per frequency
+Modes other than mid use the streaming STFT (--stft-batch, 64 frames if not given)''')
+    parser.add_argument("--max-analysis-seconds", type=seconds, default=0,
+                        help="Analyze at most this many seconds of each stem, as evenly spaced segments (e.g. 300s).\nDefault: 0 = the whole stem")
+    parser.add_argument("--segment", type=seconds, default=10,
+                        help="Length of the segments analyzed with --max-analysis-seconds (e.g. 30s). Default: 10")
+    parser.add_argument("--erb-weighting", type=str, default="bin", choices=["bin", "energy"],
+                        help='''\
+Amplitude of an ERB band:
+bin: the spectrum at the center frequency of the band (default)
+energy: the RMS of the spectrum weighted by the filter of the band''')
+    parser.add_argument("--sparse-filters", action='store_true', default=False,
+                        help="Build and apply the ERB filter bank as a sparse matrix, in the analysis and in the graphics.")
+    parser.add_argument("--stft-batch", type=int, default=0,
+                        help="Stream the STFT in batches of frames, bounding memory by the batch size. Default: 0 = off")
+    parser.add_argument("--encoding", type=str, default="default", choices=sorted(ENCODINGS),
+                        help='''\
+Encoding used to equalize:
+default: lp/eq.lp
+optimized: lp/eq_opt.lp, same answers with a smaller ground program''')
+    parser.add_argument("--prepass", action='store_true', default=True,
+                        help="Compute the shared bands and the possible masks with NumPy before solving (default).\nclingo is skipped if no band is shared, otherwise only the facts of the bands involved are grounded.")
+    parser.add_argument("--no-prepass", dest='prepass', action='store_false',
+                        help="Ground and solve the facts of all the bands.")
+    parser.add_argument("--decompose", action='store_true', default=False,
+                        help="Split the problem by ERB band and solve the parts in parallel processes.\nThe answers of the parts are combined into the mixes, so many distinct mixes need few answers per part.")
+    parser.add_argument("--solve-jobs", type=int, default=1,
+                        help="Number of processes solving the parts of --decompose. Default: 1. 0 = all cores")
+    parser.add_argument("--ground-report", action='store_true', default=False,
+                        help="Report the size of the ground program of every encoding.")
+    parser.add_argument("--optimize", action='store_true', default=False,
+                        help="Minimize the total dB change and then the number of filters (lp/minimize.lp).\nThe mixes are optimal ones, or the best found if the time limit is reached.")
+    parser.add_argument("--threads", type=int, default=1,
+                        help="Number of threads of the clingo parallel portfolio. Default: 1")
+    parser.add_argument("--time-limit", type=int, default=0,
+                        help="Time limit in seconds of each solve call. Default: 0 = no limit")
+    parser.add_argument("--renderer", type=str, default="csound", choices=["csound", "native"],
+                        help='''\
+Engine used to render the mixdowns:
+csound: render the csound files with the csound binary
+native: apply the EQs in Python, each track is decoded only once for all the mixes''')
+    parser.add_argument("--render-jobs", type=int, default=1,
+                        help="Number of mixdowns rendered by csound at the same time. Default: 1. 0 = all cores")
+    parser.add_argument("--profile-report", type=str, default=None,
+                        help="Write the time of each stage of the pipeline and the clingo statistics to this file (.json or .csv).")
+    parser.add_argument("--profile-dir", type=str, default=None,
+                        help="Profile each stage of the pipeline with cProfile and write the stats to <dir>/<stage>.prof,\nper track for the analysis and per thread for the renders. Solving runs in the main thread while profiling.")
+    parser.add_argument("--plots", type=str, default="on", choices=["off", "background", "on"],
+                        help='''\
+Graphics of the spectrums and ERB bands of the project:
+off: no graphics
+background: built in a separate process while grounding and solving
+on: built before grounding (default)''')
+    parser.add_argument("--plot-points", type=int, default=2048,
+                        help="Number of frequencies of the plotted spectrums. Default: 2048. 0 = full resolution")
     parser.add_argument("--essential-threshold", type=float, default=0.8,
                         help="Define the threshold for essential ERB bands (0-1). Default: 0.8.")
     #parser.add_argument("--normalize", action='store_true',
@@ -66,7 +167,7 @@ Set verbosity level:
 1: Default basic information printing
 2: Print EQ configuration''')
 
-    return parser.parse_args()
+    return parser.parse_args(argv)
 
 
 """
@@ -77,29 +178,238 @@ def check_input(arguments):
     ## Check for errors
     if arguments.mixes < 0:
         raise ValueError("""Number of mixes requested cannot be negative""")
-    if arguments.masking_factor <= 0 or arguments.masking_factor >= 1.0:
-        raise ValueError("""Masking factor out of bounds (0-1)""")
+    for masking_factor in arguments.masking_factor:
+        if masking_factor <= 0 or masking_factor >= 1.0:
+            raise ValueError("""Masking factor out of bounds (0-1)""")
     if arguments.essential_threshold <= 0 or arguments.essential_threshold >= 1.0:
         raise ValueError("""Essential Threshold out of bounds (0-1)""")
     if arguments.project == "":
         raise ValueError("""A project name must be given.""")
     if arguments.samples < 1000 or arguments.samples > 32768:
         raise ValueError("""Number of samples requested is out of bounds""")
-    if arguments.erb < 10 or arguments.erb > 100:
-        raise ValueError("""Number of erb bands requested is out of bounds""")
+    for erb_bands in arguments.erb:
+        if erb_bands < 10 or erb_bands > 100:
+            raise ValueError("""Number of erb bands requested is out of bounds""")
+    if len(set(arguments.erb)) != len(arguments.erb):
+        raise ValueError("""Numbers of erb bands must be different""")
+    if arguments.stft_batch < 0:
+        raise ValueError("""STFT batch size cannot be negative""")
+    if arguments.max_analysis_seconds < 0:
+        raise ValueError("""Maximum analysis time cannot be negative""")
+    if arguments.segment <= 0:
+        raise ValueError("""Segment length must be positive""")
+    if arguments.jobs < 0:
+        raise ValueError("""Number of jobs cannot be negative""")
+    if arguments.cache_size < 0:
+        raise ValueError("""Cache size cannot be negative""")
+    if arguments.render_jobs < 0:
+        raise ValueError("""Number of render jobs cannot be negative""")
+    if arguments.plot_points < 0:
+        raise ValueError("""Number of plot points cannot be negative""")
+    if arguments.threads < 1:
+        raise ValueError("""Number of threads must be positive""")
+    if arguments.time_limit < 0:
+        raise ValueError("""Time limit cannot be negative""")
+    if arguments.q <= 0 or arguments.q > 1.0:
+        raise ValueError("""Density of XOR constraints out of bounds (0-1]""")
+    if arguments.s >= 0 and arguments.optimize:
+        raise ValueError("""Sampling and optimization cannot be combined""")
+    if arguments.s >= 0 and arguments.mixes == 0:
+        raise ValueError("""Sampling needs a positive number of mixes""")
+    if arguments.solve_jobs < 0:
+        raise ValueError("""Number of solve jobs cannot be negative""")
+    if arguments.decompose and (arguments.optimize or arguments.s >= 0 or arguments.time_limit > 0):
+        raise ValueError("""Decomposed solving cannot be combined with optimization, sampling or a time limit""")
+    if arguments.decompose and not arguments.analyze:
+        raise ValueError("""Decomposed solving needs the analysis of the tracks""")
     
     
 
-""" 
-Main function
-Get ERB bands, build instances, ground, solve and parse answer sets to mix
 """
-def main():
+Instance file of a track. resolution is the suffix of its number of ERB bands (_B<B>),
+empty when a single resolution is analyzed
+"""
+def instance_file(project, track, resolution=""):
+    return "projects/%s/%s%s.lp"%(project, track, resolution)
 
-    ## Parse input data
-    args = parse_params()
-    ## Check for input errors
-    check_input(args)
+"""
+Clingo arguments wrt the options: random signs for diverse mixes, parallel portfolio and optimization
+"""
+def clingo_arguments(args):
+    clingo_args = ["--sign-def=rnd",
+                   "--sign-fix",
+                   "--rand-freq=1",
+                   "--seed=%s"%random.randint(0,32767),
+                   "--restart-on-model",
+                   "--enum-mode=record"]
+    if args.threads > 1:
+        ## Parallel portfolio, the threads compete for the same answers with different configurations
+        clingo_args.append("--parallel-mode=%s,compete"%args.threads)
+    if args.optimize:
+        ## Find the optimum first, then enumerate optimal answers
+        clingo_args.append("--opt-mode=optN")
+    return clingo_args
+
+"""
+Create a clingo control object with the encoding, the track facts and/or instance files, and the masking factors.
+A single masking factor is a fact, a sweep declares one external per factor so the program is grounded only once.
+If optimize, the minimize statements and the dB table are added as well.
+"""
+def create_control(clingo_args, encoding, facts, instances, masking_factors, optimize=False):
+    control = clingo.Control(clingo_args)
+    ## Load the encoding
+    control.load(encoding)
+    if optimize:
+        control.load(MINIMIZE)
+        control.add("base", [], af.build_asp_db_table())
+    ## Instance files
+    for instance in instances:
+        control.load(instance)
+    ## Add all the track facts at once, no round trip through instance files
+    if facts:
+        control.add("base", [], facts)
+
+    ## Add masking factor
+    if len(masking_factors) == 1:
+        control.add("p", [], "masking_factor(%s)."%masking_factors[0])
+    else:
+        control.add("p", [], "".join("#external masking_factor(%s)."%factor for factor in masking_factors))
+
+    return control
+
+"""
+Solve and pass each answer to on_answer as soon as it is found, no answer is kept.
+Return the number of answers, the solve result and whether the answers are proven optimal.
+The search is stopped after time_limit seconds (0 = no limit).
+If optimize, only the optimal answers are passed, or the best one found if the optimum is not proven in time.
+If synchronous, clingo solves in this thread, so the answers are handled in this thread as well (e.g. to profile them).
+"""
+def solve_answers(control, time_limit, optimize, on_answer, synchronous=False):
+    answers = 0
+    best = []
+    def on_model(model):
+        nonlocal answers
+        if optimize and not model.optimality_proven:
+            ## Improving answers are not final, only the best one is kept
+            best[:] = [model.symbols(shown=True)]
+            print("Optimization: %s"%" ".join(str(cost) for cost in model.cost))
+        else:
+            answers += 1
+            if optimize and answers == 1:
+                print("Optimum: %s"%" ".join(str(cost) for cost in model.cost))
+            on_answer(model.symbols(shown=True))
+
+    if synchronous:
+        alarm = threading.Timer(time_limit, control.interrupt) if time_limit > 0 else None
+        if alarm is not None:
+            alarm.start()
+        solve_result = control.solve(on_model=on_model)
+        if alarm is not None:
+            alarm.cancel()
+        if solve_result.interrupted:
+            print("Time limit reached")
+    else:
+        with control.solve(on_model=on_model, async_=True) as handle:
+            if not handle.wait(time_limit if time_limit > 0 else None):
+                print("Time limit reached")
+                handle.cancel()
+            solve_result = handle.get()
+
+    proven = optimize and answers > 0
+    if optimize and not answers and best:
+        on_answer(best[0])
+        answers = 1
+    return answers, solve_result, proven
+
+class Results(object):
+    """
+    Write the plan of the answers and the Csound file of each mixdown as the answers arrive, and submit them to the renderer.
+    tracks = dict track id -> name of the stem (see ProjectManifest.names)
+    Each track is played in the Csound score for its own duration (durations = dict track id -> seconds).
+    The plan is written as text (plan_<params>.txt) and as JSON Lines (plan_<params>.jsonl, one answer with its EQs per line,
+    see audio_features.read_plan). The plan files are only created with the first answer.
+    """
+    def __init__(self, project, file_params, tracks, center_fr, bandwidths, durations, renderer, timer):
+        self.results_path = "%s/results/"%("projects/%s"%(project))
+        self.file_params = file_params
+        self.tracks = tracks
+        self.center_fr = center_fr
+        self.bandwidths = bandwidths
+        self.durations = durations
+        self.renderer = renderer
+        self.timer = timer
+        self.answers = 0
+        self.plan = None
+        self.plan_file = None
+        self.records = None
+
+    def write(self, answer):
+        if self.plan is None:
+            dir = os.path.dirname(self.results_path)
+            if not os.path.exists(dir):
+                os.makedirs(dir)
+            self.plan_file = "%s/plan_%s.txt"%(self.results_path, self.file_params)
+            self.plan = open(self.plan_file,"w")
+            self.records = open("%s/plan_%s.jsonl"%(self.results_path, self.file_params),"w")
+        self.answers += 1
+        answer_number = self.answers
+        tracks = self.tracks
+        print("Answer: %s"%answer_number)
+        print(answer)
+
+        #Plan
+        with self.timer.stage("plan"):
+            self.plan.write("Answer: %s \n"%answer_number)
+            eqs = af.parse_answer_sets_to_plan(self.plan, tracks, answer, self.center_fr, self.bandwidths)
+            self.plan.write("\n")
+            csound_file = "Answer_%s_mixdown_%s.csd"%(answer_number, self.file_params)
+            self.records.write(json.dumps({"answer": answer_number, "csd": csound_file, "eqs": eqs})+"\n")
+
+        #Csound
+        with self.timer.stage("csd"):
+            file_csd = open("%s/%s"%(self.results_path, csound_file),"w")
+            csd.create_header(file_csd, self.results_path, csound_file)
+
+            for track_id in tracks:
+                if track_id in eqs:
+                    ## Create csound instrument with EQs
+                    csd.create_instrument(file_csd, track_id, eqs[track_id])
+                else:
+                    ## Create csound instrument without EQ
+                    csd.create_instrument(file_csd, track_id, None)
+
+            # Csound Bridge between Orchestra and Scores
+            csd.create_bridge(file_csd)
+
+            # Csound Orchestra
+            for track_id in tracks:
+                csd.create_orchestra(file_csd, track_id, tracks[track_id], round(self.durations[track_id], 3))
+
+            # Csound Footer
+            csd.create_footer(file_csd)
+
+            # Close file
+            file_csd.close()
+
+        # Render csound files in the background
+        #if args.normalize:
+        #    print("normalize tracks")
+        self.renderer.submit(self.results_path, csound_file, eqs)
+
+        print("")
+
+    def close(self):
+        if self.plan is not None:
+            self.plan.close()
+            self.records.close()
+
+""" 
+Get ERB bands, build instances, ground, solve and parse answer sets to mix.
+Return a summary of the run: timings of the stages, and answers, plan file and statistics per masking factor.
+"""
+def run(args):
+    summary = {"project": args.project, "timings": {}, "factors": [], "failed_renders": 0}
+    timer = StageTimer(args.profile_dir)
 
     # Input data
     ## STFT parameters
@@ -107,7 +417,7 @@ def main():
     N  = args.samples  # FFT size or Number of Samples
     M  = N             # Window size 
     H  = int(M/64)     # Hop size
-    B  = args.erb      # ERB Bands
+    batch = args.stft_batch # STFT frames per batch (0 = whole track)
     low_lim = 20       # centre freq. of lowest filter
     high_lim = sr / 2  # centre freq. of highest filter
     threshold = args.essential_threshold # Essential bands
@@ -119,156 +429,288 @@ def main():
     
     ## ASP variables
     project = args.project #project name
-    models = [] # answer sets
-    tracks = []
-    tracks_duration = []
+    masking_factors = [int(factor*100) for factor in args.masking_factor]
 
     ## Read wav files from project
     print("Reading tracks...")
-    for fl in os.listdir("projects/%s/"%project):
-        if fl.endswith(".wav"):
-            tracks.append(os.path.splitext(fl)[0])
-            if analyze:
-                t = "projects/%s/%s.wav"%(project, os.path.splitext(fl)[0])
-                with contextlib.closing(wave.open(t,'r')) as f:
-                    frames = f.getnframes()
-                    rate = f.getframerate()
-                    duration = frames / float(rate)
-                    tracks_duration.append(duration)
-
-    if analyze:
-        duration = int(round(max(tracks_duration)))
-        print("Mixdown duration (secs): %s"%duration)
-
-    ## create tracks instance lp
-    ## get audio features and create each track_name.lp file
-    file_params = "S%s_B%s_ET%s_MF%s"%(N,B,args.essential_threshold,args.masking_factor)
-
-    ## Create clingo object and load instances
-    ## Add arguments
-    if solve:
-        clingo_args = ["--sign-def=rnd",
-                       "--sign-fix",
-                       "--rand-freq=1",
-                       "--seed=%s"%random.randint(0,32767),
-                       "--restart-on-model",
-                       "--enum-mode=record"]
-        control = clingo.Control(clingo_args)
-        ## Load eq.lp
-        control.load("lp/eq.lp")
-
-    ## for each track
-    track_number = 1
-    frequencies = []
+    with timer.stage("reading"):
+        ## Track ids are kept in the manifest of the project, only the headers of new or modified stems are read
+        manifest = ProjectManifest("projects/%s"%project)
+        tracks = manifest.scan()
+        track_ids = manifest.ids()
+        names = manifest.names()
+        tracks_duration = dict((track_id, manifest.duration(names[track_id])) for track_id in track_ids)
+    if manifest.changed() or manifest.removed:
+        print("Added: %s, modified: %s, removed: %s"%(", ".join(manifest.added) or "-", ", ".join(manifest.modified) or "-",
+                                                      ", ".join(manifest.removed) or "-"))
+        if not analyze and (manifest.added or manifest.removed):
+            print("Warning: the stems changed, export the instances again (--analyze --export-instances)")
+
+    ## Exact length of the longest stem, as played by the csound score
+    duration = max(tracks_duration.values())
+    print("Mixdown duration (secs): %s"%round(duration, 3))
+
+    ## Analysis cache, unchanged stems are not hashed again
+    cache = None
+    if analyze and args.cache_size > 0:
+        cache = AnalysisCache("projects/%s/.cache"%project, args.cache_size*1024*1024)
+        with timer.stage("reading"):
+            manifest.use_hashes(cache)
+    manifest.write()
+
+    ## Get the spectrum of all tracks once, and their ERB amplitudes for every resolution, in parallel if requested
     spectrums = []
-    erbs = []
-    filters = []
-    for track in tracks:
-        if analyze:
-            print(" Building instance: %s"%track)
-            ## Get spectrum and signal size
-            spectrum, len_signal = af.get_spectrum("projects/%s/%s"%(project,track), sr, N, M, H)
-
-            # Equivalent Rectangular Bandwidth
-            erb_bands, bandwidths, frequencies, center_fr, filters = af.get_erb_bands(spectrum, len_signal, sr, B, low_lim, high_lim)
+    erbs_by_resolution = dict((B, []) for B in args.erb)
+    if analyze:
+        jobs = args.jobs if args.jobs > 0 else os.cpu_count()
+        analysis = af.analyze_tracks(["projects/%s/%s"%(project,track) for track in tracks],
+                                     sr, N, M, H, batch, args.erb, low_lim, high_lim, cache, jobs, args.erb_weighting,
+                                     args.channels, args.max_analysis_seconds, args.segment, args.sparse_filters,
+                                     args.profile_dir)
+        for track in tracks:
+            ## Wall time of the analysis, and the time of its stages in the (possibly parallel) workers
+            with timer.stage("analysis"):
+                spectrum, erb_amps, stages = next(analysis)
+            for stage, entry in stages.items():
+                timer.add(stage, entry["time"], entry["calls"])
+            for B in args.erb:
+                erbs_by_resolution[B].append(erb_amps[B])
+            print(" Analyzed: %s"%track)
 
             # Save data for plotting
-            spectrums.append(spectrum)
-            erbs.append(erb_bands)
-        
-        # ASP instances
-        instance = "projects/%s/%s.lp"%(project,track)
-        if analyze: ## If not benchmark
-            file = open(instance,"w")
-            af.build_asp_instance(file, track_number, instance, erb_bands, threshold)
-            file.close()
-
-        if solve:
-            control.load("projects/%s/%s.lp"%(project,track))
-        track_number+=1
-
-    # Build mixdown graphics
-    if analyze:
-        print("Building graphics...")
-        af.build_graphics(frequencies, spectrums, "projects/%s"%(project), project, erbs, B, filters, tracks, False)
+            if args.plots != "off":
+                spectrums.append(spectrum)
 
-    ## Number of mixes
+    ## Mixdowns of all the resolutions are rendered while solving
+    renderer = None
     if solve:
-        control.configuration.solve.models = args.mixes
-
-        ## Add masking factor
-        control.add("p", [], "#const masking_factor = %s."%int(args.masking_factor*100))
-        ## Ground
-        print("Grounding...")
-        control.ground([("base", [])])
-        control.ground([("p", [])])
-        ## Solve
-        if s >= 0:
-            print("Propagator Registered for Sampling")
-            control.register_propagator(Propagator(s,q))
-        print("Solving...")
-        solve_result = control.solve(None, lambda model: models.append(model.symbols(shown=True)))
-
-        if str(solve_result) == "SAT":
-            print("%s, Exhausted: %s"%(solve_result,solve_result.exhausted))
-            print(models)
-            print("")
-            results_path = "%s/results/"%("projects/%s"%(project))
-            dir = os.path.dirname(results_path)
-            if not os.path.exists(dir):
-                os.makedirs(dir)
-
-            file = open("%s/plan_%s.txt"%(results_path, file_params),"w")
-            for answer in models:
-                answer_number = models.index(answer)+1
-                print("Answer: %s"%answer_number)
-
-                #Plan
-                file.write("Answer: %s \n"%answer_number)
-                eqs = af.parse_answer_sets_to_plan(file, tracks, answer, center_fr, bandwidths)
-                file.write("\n")
-
-                #Csound
-                csound_file = "Answer_%s_mixdown_%s.csd"%(answer_number, file_params)
-                file_csd = open("%s/%s"%(results_path, csound_file),"w")
-                csd.create_header(file_csd, results_path, csound_file)
-
-                for i in range(len(tracks)):
-                    if (i+1) in eqs:
-                        ## Create csound instrument with EQs
-                        csd.create_instrument(file_csd, i+1, eqs[(i+1)])
+        render_jobs = args.render_jobs if args.render_jobs > 0 else os.cpu_count()
+        if args.renderer == "native":
+            ## scipy is only imported by the native renderer
+            from classes.mixer import NativeRenderer
+            renderer = NativeRenderer(render_jobs, dict((track_id, "projects/%s/%s.wav"%(project, names[track_id])) for track_id in track_ids),
+                                      sr, duration, timer=timer)
+        else:
+            renderer = csd.Renderer(render_jobs, timer)
+
+    graphics = []
+    for B in args.erb:
+        ## Instances, graphics and results of each resolution get their own names when several are requested
+        resolution = "" if len(args.erb) == 1 else "_B%s"%B
+        if len(args.erb) > 1:
+            print("ERB bands: %s"%B)
+
+        # Equivalent Rectangular Bandwidth
+        ## The filter bank only depends on the spectrum length (N/2+1 bins) and the ERB parameters
+        bandwidths, frequencies, center_fr, filters, _ = af.get_erb_bank(int(N/2)+1, sr, B, low_lim, high_lim, args.sparse_filters)
+
+        ## for each track
+        track_erbs = erbs_by_resolution[B]
+        facts = []
+        instances = []
+        for i, track in enumerate(tracks):
+            # ASP instances
+            instance = instance_file(project, track, resolution)
+            if analyze:
+                erb_bands = track_erbs[i]
+                with timer.stage("instance"):
+                    facts.append(af.build_asp_facts(track_ids[i], erb_bands, threshold))
+                    if args.export_instances or benchmark:
+                        file = open(instance,"w")
+                        af.build_asp_instance(file, track_ids[i], instance, erb_bands, threshold)
+                        file.close()
+            else:
+                instances.append(instance)
+        erbs = track_erbs if args.plots != "off" else []
+        
+        # Build mixdown graphics
+        if analyze and args.plots == "background":
+            print("Building graphics in the background...")
+            graphics.append(af.build_graphics_background(frequencies, spectrums, "projects/%s"%(project), project+resolution, erbs, B, filters, tracks, args.plot_points))
+        elif analyze and args.plots == "on":
+            print("Building graphics...")
+            with timer.stage("graphics"):
+                af.build_graphics(frequencies, spectrums, "projects/%s"%(project), project+resolution, erbs, B, filters, tracks, False, args.plot_points)
+
+        ## Masking pre-analysis: without shared bands there are no answers,
+        ## otherwise only the erb_band/3 facts of the possible masks (for the lowest factor) are needed
+        solve_facts = facts
+        conflict = True
+        if analyze and args.prepass and track_erbs:
+            with timer.stage("prepass"):
+                index = MaskingIndex(track_erbs, threshold, min(masking_factors), track_ids)
+                conflict = index.conflict()
+                if conflict:
+                    involved = index.involved()
+                    solve_facts = [af.build_asp_facts(track_ids[i], erb_bands, threshold, involved[i]) for i, erb_bands in enumerate(track_erbs)]
+            print("Masking pre-analysis: %s shared bands, %s possible masks"%(int(index.shared.sum()), len(index.masks())))
+
+        ## Size of the ground program of each encoding
+        if args.ground_report:
+            print("Ground program size:")
+            for encoding in sorted(ENCODINGS):
+                observer = ProgramSizeObserver()
+                report_control = create_control([], ENCODINGS[encoding], "".join(solve_facts), instances, masking_factors)
+                report_control.register_observer(observer)
+                report_control.ground([("base", []), ("p", [])])
+                print(" %s: %s"%(encoding, observer.summary()))
+
+        if solve and not conflict:
+            ## No shared band, clingo is not called
+            for masking_factor in args.masking_factor:
+                print("No masking detected for the given values masking-factor and/or essential-threshold")
+                summary["factors"].append({"erb": B, "masking_factor": masking_factor, "answers": 0, "result": "UNSAT", "exhausted": True,
+                                           "proven": None, "plan": None, "time": 0.0,
+                                           "statistics": {"models": 0, "solve_time": 0.0, "choices": 0, "conflicts": 0}})
+
+        elif solve:
+            if args.decompose:
+                solve_jobs = args.solve_jobs if args.solve_jobs > 0 else os.cpu_count()
+                for masking_factor, factor in zip(args.masking_factor, masking_factors):
+                    file_params = "S%s_B%s_ET%s_MF%s"%(N,B,args.essential_threshold,masking_factor)
+                    results = Results(project, file_params, names, center_fr, bandwidths, tracks_duration, renderer, timer)
+                    print("Solving by band...")
+                    start = time.time()
+                    with timer.stage("solving"):
+                        answers, exhausted, statistics = decompose.solve(lambda: clingo_arguments(args), ENCODINGS[args.encoding],
+                                                                         MaskingIndex(track_erbs, threshold, factor, track_ids), factor,
+                                                                         args.mixes, solve_jobs, results.write)
+                    print("Parts: %s, Answers: %s, Exhausted: %s"%(statistics["parts"], answers, exhausted))
+                    if not answers:
+                        print("No masking detected for the given values masking-factor and/or essential-threshold")
+                    results.close()
+                    summary["factors"].append({"erb": B, "masking_factor": masking_factor,
+                                               "answers": answers,
+                                               "result": "SAT" if answers else "UNSAT",
+                                               "exhausted": exhausted,
+                                               "proven": None,
+                                               "plan": results.plan_file,
+                                               "time": time.time() - start,
+                                               "statistics": statistics})
+
+            ## Create clingo object and load instances
+            ## Add arguments
+            else:
+                clingo_args = clingo_arguments(args)
+                control = create_control(clingo_args, ENCODINGS[args.encoding], "".join(solve_facts), instances, masking_factors, args.optimize)
+
+                ## Number of mixes
+                control.configuration.solve.models = args.mixes
+
+                ## Ground
+                print("Grounding...")
+                ## Both parts at once, the encoding needs masking_factor/1 from p
+                with timer.stage("grounding"):
+                    control.ground([("base", []), ("p", [])])
+                ## Solve
+                if s >= 0:
+                    print("Propagator Registered for Sampling")
+                    control.register_propagator(Propagator(s,q))
+
+                for masking_factor, factor in zip(args.masking_factor, masking_factors):
+                    ## Activate only the external of the current factor
+                    if len(masking_factors) > 1:
+                        print("Masking factor: %s"%masking_factor)
+                        for other in masking_factors:
+                            control.assign_external(clingo.Function("masking_factor", [clingo.Number(other)]), other == factor)
+
+                    ## create tracks instance lp
+                    file_params = "S%s_B%s_ET%s_MF%s"%(N,B,args.essential_threshold,masking_factor)
+
+                    ## Each answer is written and queued for rendering as soon as it is found
+                    results = Results(project, file_params, names, center_fr, bandwidths, tracks_duration, renderer, timer)
+                    print("Solving...")
+                    start = time.time()
+                    solve_result = proven = None
+                    ## The solving time includes the plan and csd stages of the answers, written from the model callback
+                    if s >= 0:
+                        ## One solving step per mix, each one in a new random cell of the XOR constraints
+                        with timer.stage("solving"):
+                            answers = sample(control, args.mixes, on_model=results.write)
+                        if answers:
+                            print("SAT, Samples: %s"%answers)
                     else:
-                        ## Create csound instrument without EQ
-                        csd.create_instrument(file_csd, i+1, None)
-
-                # Csound Bridge between Orchestra and Scores
-                csd.create_bridge(file_csd)
-
-                # Csound Orchestra
-                for i in range(len(tracks)):
-                    csd.create_orchestra(file_csd, (i+1), tracks[i], duration)
+                        with timer.stage("solving"):
+                            ## Profiled answers are written in the main thread, as the plan and csd stages of the solving one
+                            answers, solve_result, proven = solve_answers(control, args.time_limit, args.optimize, results.write,
+                                                                          args.profile_dir is not None)
+                        if args.optimize and answers:
+                            print("%s, Optimum proven: %s"%(solve_result, proven))
+                        elif str(solve_result) == "SAT":
+                            print("%s, Exhausted: %s"%(solve_result,solve_result.exhausted))
+
+                    if not answers:
+                        print("No masking detected for the given values masking-factor and/or essential-threshold")
+                    results.close()
+                    summary["factors"].append({"erb": B, "masking_factor": masking_factor,
+                                               "answers": answers,
+                                               "result": str(solve_result) if solve_result is not None else ("SAT" if answers else "UNSAT"),
+                                               "exhausted": solve_result.exhausted if solve_result is not None else None,
+                                               "proven": proven,
+                                               "plan": results.plan_file,
+                                               "time": time.time() - start,
+                                               "statistics": solve_statistics(control)})
+                    timer.metric("clingo%s_MF%s"%(resolution, masking_factor), control.statistics)
+
+        if benchmark:
+            ## Create a single file instance with the masking factor constant and with all the sub instances of the project
+            print("Generating Benchmarks")
+            benchmarks_path = "projects/%s/benchmarks"%project
+            if not os.path.exists(benchmarks_path):
+                os.makedirs(benchmarks_path)
+            instance_facts = "".join(facts)
+            for instance in instances:
+                with open(instance) as file:
+                    instance_facts += file.read()
+            for masking_factor, factor in zip(args.masking_factor, masking_factors):
+                benchmark_file = "%s/%s_S%s_B%s_ET%s_MF%s.lp"%(benchmarks_path, project, N, B, threshold, masking_factor)
+                with open(benchmark_file, "w") as file:
+                    file.write("%% Benchmark: %s\n"%project)
+                    file.write("%% Tracks: %s\n"%", ".join(tracks))
+                    file.write("%% Run: clingo %s %s\n\n"%(ENCODINGS[args.encoding], benchmark_file))
+                    file.write("masking_factor(%s).\n"%factor)
+                    file.write(instance_facts)
+                print(" %s"%benchmark_file)
+
+    if renderer is not None:
+        ## Wait for the renders of all the resolutions and masking factors
+        with timer.stage("render_wait"):
+            failed = renderer.wait()
+        renderer.close()
+        summary["failed_renders"] = failed
+        if failed:
+            print("%s of the renders failed"%failed)
+
+    for process in graphics:
+        with timer.stage("graphics_wait"):
+            process.join()
+
+    ## Stage report
+    summary["timings"] = timer.times()
+    if args.verbose >= 1:
+        print("Stage times (secs):")
+        for stage, elapsed in summary["timings"].items():
+            print(" %s: %.3f"%(stage, elapsed))
+    if args.profile_report is not None:
+        timer.write(args.profile_report)
+    timer.dump_profiles()
+
+    return summary
 
-                # Csound Footer
-                csd.create_footer(file_csd)
-
-                # Close file
-                file_csd.close()
-
-                # Render csound files
-                #if args.normalize:
-                #    print("normalize tracks")
-                csd.render(results_path, csound_file)
-
-                print("")
-            file.close()
-        else:
-            print("No masking detected for the given values masking-factor and/or essential-threshold")
+""" 
+Main function
+Parse the command line (or argv) and run aspeq. Exit status 1 if a render failed.
+"""
+def main(argv=None):
 
+    ## Parse input data
+    args = parse_params(argv)
+    ## Check for input errors
+    check_input(args)
 
-    if benchmark:
-        ## Create a single file instance with the masking factor constant and with all the sub instances of the project
-        print("Generating Benchmarks")
-        
+    summary = run(args)
+    if summary["failed_renders"]:
+        return 1
 
 
 """
@@ -0,0 +1,171 @@
+"""
+Batch runner: run aspeq over many projects and parameter grids and record the results in a SQLite database.
+
+The manifest is a JSON file, e.g.
+{
+    "projects": ["demo", "song"],
+    "grid": {"samples": [32768], "erb": [20, 40], "essential_threshold": [0.7, 0.8], "masking_factor": [0.3, 0.5]},
+    "options": ["--mixes=2"]
+}
+Every combination of project, samples, erb and essential threshold is a job. The masking factors are swept inside
+each job over a single grounding, and options are passed to aspeq as they are.
+Jobs of the same project run one after another in the same worker, so they share the cached spectrums and never
+write the files of the project (graphics, instances, manifest) at the same time.
+Finished jobs are kept in the database and skipped when the batch is run again, e.g. after a crash.
+"""
+
+# Imports
+import sys
+import os
+import json
+import time
+import sqlite3
+import argparse
+import itertools
+import contextlib
+import traceback
+from concurrent.futures import ProcessPoolExecutor
+import aspeq
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS jobs (
+    id INTEGER PRIMARY KEY,
+    project TEXT, samples INTEGER, erb INTEGER, essential_threshold REAL, masking_factors TEXT, options TEXT,
+    status TEXT DEFAULT 'pending', started REAL, finished REAL, error TEXT,
+    reading REAL, analysis REAL, grounding REAL, rendering REAL, failed_renders INTEGER,
+    UNIQUE (project, samples, erb, essential_threshold, masking_factors, options));
+CREATE TABLE IF NOT EXISTS results (
+    job_id INTEGER REFERENCES jobs(id), masking_factor REAL,
+    answers INTEGER, result TEXT, exhausted INTEGER, proven INTEGER, plan_file TEXT, plan TEXT, time REAL,
+    models INTEGER, solve_time REAL, choices INTEGER, conflicts INTEGER,
+    PRIMARY KEY (job_id, masking_factor));
+"""
+
+"""
+Parse Arguments
+"""
+def parse_params():
+    parser = argparse.ArgumentParser(prog='batch.py',
+                                     description="Run aspeq over the projects and parameter grids of a manifest.")
+    parser.add_argument("manifest", type=str,
+                        help="JSON file with the projects, the parameter grid and the aspeq options.")
+    parser.add_argument("--db", type=str, default="batch.sqlite",
+                        help="SQLite database of the results. Default: batch.sqlite")
+    parser.add_argument("--workers", type=int, default=0,
+                        help="Number of worker processes. Default: 0 = all cores")
+    return parser.parse_args()
+
+def connect(db):
+    ## Workers write their own results, wait for the other writers
+    connection = sqlite3.connect(db, timeout=60)
+    connection.executescript(SCHEMA)
+    return connection
+
+"""
+Insert the jobs of the manifest that are not in the database yet.
+Return the jobs to run (not finished), grouped by project
+"""
+def create_jobs(connection, manifest):
+    grid = manifest.get("grid", {})
+    options = json.dumps(manifest.get("options", []))
+    masking_factors = ",".join(str(factor) for factor in grid.get("masking_factor", [0.5]))
+    for project, samples, erb, threshold in itertools.product(manifest["projects"],
+                                                             grid.get("samples", [32768]),
+                                                             grid.get("erb", [40]),
+                                                             grid.get("essential_threshold", [0.8])):
+        connection.execute("INSERT OR IGNORE INTO jobs (project, samples, erb, essential_threshold, masking_factors, options) "
+                           "VALUES (?, ?, ?, ?, ?, ?)", (project, samples, erb, threshold, masking_factors, options))
+    connection.commit()
+
+    groups = {}
+    ## Jobs left running by a crash are run again
+    for row in connection.execute("SELECT id, project, samples, erb, essential_threshold, masking_factors, options "
+                                  "FROM jobs WHERE status != 'done' ORDER BY id"):
+        groups.setdefault(row[1], []).append(row)
+    return list(groups.values())
+
+"""
+Run a job with aspeq and record its timings, answers, plans and statistics
+"""
+def run_job(connection, job):
+    job_id, project, samples, erb, threshold, masking_factors, options = job
+    argv = ["--project=%s"%project, "--samples=%s"%samples, "--erb=%s"%erb,
+            "--essential-threshold=%s"%threshold, "--masking-factor=%s"%masking_factors] + json.loads(options)
+    connection.execute("UPDATE jobs SET status = 'running', started = ?, error = NULL WHERE id = ?", (time.time(), job_id))
+    connection.execute("DELETE FROM results WHERE job_id = ?", (job_id,))
+    connection.commit()
+
+    log = "projects/%s/batch_%s.log"%(project, job_id)
+    try:
+        with open(log, "w") as f, contextlib.redirect_stdout(f):
+            args = aspeq.parse_params(argv)
+            aspeq.check_input(args)
+            summary = aspeq.run(args)
+    except (Exception, SystemExit):
+        ## argparse exits on invalid options of the manifest, only this job fails
+        connection.execute("UPDATE jobs SET status = 'failed', finished = ?, error = ? WHERE id = ?",
+                           (time.time(), traceback.format_exc(), job_id))
+        connection.commit()
+        return False
+
+    timings = summary["timings"]
+    for factor in summary["factors"]:
+        plan = None
+        if factor["plan"] is not None:
+            with open(factor["plan"]) as f:
+                plan = f.read()
+        statistics = factor["statistics"]
+        connection.execute("INSERT INTO results VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                           (job_id, factor["masking_factor"], factor["answers"], factor["result"], factor["exhausted"],
+                            factor["proven"], factor["plan"], plan, factor["time"], statistics["models"],
+                            statistics["solve_time"], statistics["choices"], statistics["conflicts"]))
+    connection.execute("UPDATE jobs SET status = 'done', finished = ?, reading = ?, analysis = ?, grounding = ?, "
+                       "rendering = ?, failed_renders = ? WHERE id = ?",
+                       (time.time(), timings.get("reading"), timings.get("analysis"), timings.get("grounding"),
+                        timings.get("rendering"), summary["failed_renders"], job_id))
+    connection.commit()
+    return True
+
+"""
+Run the jobs of a group one after another, return the number of finished jobs
+"""
+def run_group(db, jobs):
+    connection = connect(db)
+    finished = 0
+    for job in jobs:
+        if run_job(connection, job):
+            finished += 1
+    connection.close()
+    return finished
+
+"""
+Main function
+"""
+def main():
+    args = parse_params()
+    if args.workers < 0:
+        raise ValueError("""Number of workers cannot be negative""")
+    with open(args.manifest) as f:
+        manifest = json.load(f)
+
+    connection = connect(args.db)
+    groups = create_jobs(connection, manifest)
+    connection.close()
+    total = sum(len(jobs) for jobs in groups)
+    print("Jobs to run: %s"%total)
+    if not groups:
+        return
+
+    workers = args.workers if args.workers > 0 else os.cpu_count()
+    with ProcessPoolExecutor(max_workers=min(workers, len(groups))) as pool:
+        finished = sum(pool.map(run_group, [args.db]*len(groups), groups))
+    print("Jobs finished: %s, failed: %s"%(finished, total - finished))
+    if finished < total:
+        return 1
+
+
+"""
+Main function
+"""
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,102 @@
+"""
+Benchmark of the XOR sampling against the enumeration of aspeq (--enum-mode=record).
+Both modes are timed while producing the same number of distinct mixes from the instances of a project
+(projects/<name>/<track>.lp, or <track>_B<erb>.lp for runs with several resolutions, see aspeq.py --export-instances).
+"""
+
+# Imports
+import sys
+import clingo
+import argparse
+import random
+import time
+import aspeq
+from classes.count_propagator import Propagator, sample
+from classes.manifest import ProjectManifest
+
+"""
+Parse Arguments
+"""
+def parse_params():
+    parser = argparse.ArgumentParser(prog='benchmark_sampling.py',
+                                     description="Compare the time to get distinct mixes with enumeration and with XOR sampling.")
+    parser.add_argument("--project", type=str, default="demo",
+                        help="Name of the project where the instances are stored.")
+    parser.add_argument("--erb", type=int, default=0,
+                        help="Number of ERB bands of the instances, exported by a run with several resolutions (<track>_B<erb>.lp). Default: 0 = the instances of a run with a single resolution (<track>.lp)")
+    parser.add_argument("--encoding", type=str, default="lp/eq.lp",
+                        help="Encoding used to equalize. Default: lp/eq.lp")
+    parser.add_argument("--masking-factor", type=float, default=0.5,
+                        help="Define the masking factor (0-1). Default: 0.5.")
+    parser.add_argument("--mixes", type=int, default=10,
+                        help="Number of distinct mixes. Default: 10")
+    parser.add_argument("--s", type=int, default=4,
+                        help="Number of XOR constraints. Default: 4")
+    parser.add_argument("--q", type=float, default=0.5,
+                        help="Density of XOR constraints. Default: 0.5")
+    parser.add_argument("--runs", type=int, default=3,
+                        help="Number of runs of each mode. Default: 3")
+    return parser.parse_args()
+
+"""
+Ground the encoding with the instances of the tracks of the project for erb bands (0 = single resolution run)
+and the masking factor
+"""
+def create_control(project, erb, encoding, masking_factor):
+    control = clingo.Control(["--sign-def=rnd",
+                              "--sign-fix",
+                              "--rand-freq=1",
+                              "--seed=%s"%random.randint(0,32767),
+                              "--restart-on-model",
+                              "--enum-mode=record"])
+    control.load(encoding)
+    resolution = "_B%s"%erb if erb > 0 else ""
+    for track in ProjectManifest("projects/%s"%project).scan():
+        control.load(aspeq.instance_file(project, track, resolution))
+    control.add("p", [], "masking_factor(%s)."%int(masking_factor*100))
+    control.ground([("base", []), ("p", [])])
+    return control
+
+"""
+Enumerate the first mixes answers
+"""
+def enumerate_mixes(control, mixes):
+    models = []
+    control.configuration.solve.models = mixes
+    control.solve(on_model=lambda model: models.append(frozenset(str(atom) for atom in model.symbols(shown=True))))
+    return models
+
+"""
+Sample mixes answers, one solving step with new XOR constraints each
+"""
+def sample_mixes(control, mixes, s, q):
+    models = []
+    control.register_propagator(Propagator(s, q))
+    sample(control, mixes, on_model=lambda answer: models.append(frozenset(str(atom) for atom in answer)))
+    return models
+
+"""
+Main function
+"""
+def main():
+    args = parse_params()
+
+    print("Mode        Run  Time (s)  Distinct  Mixes/s")
+    for mode in ["enumeration", "sampling"]:
+        for run in range(args.runs):
+            control = create_control(args.project, args.erb, args.encoding, args.masking_factor)
+            start = time.time()
+            if mode == "enumeration":
+                models = enumerate_mixes(control, args.mixes)
+            else:
+                models = sample_mixes(control, args.mixes, args.s, args.q)
+            elapsed = time.time() - start
+            distinct = len(set(models))
+            print("%-11s %3d  %8.3f  %8d  %7.1f"%(mode, run+1, elapsed, distinct, distinct/elapsed if elapsed > 0 else 0))
+
+
+"""
+Main function
+"""
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,228 @@
+"""
+Benchmark suite of the aspeq pipeline on synthetic data, to catch performance regressions of the encodings and the analysis.
+
+Encoding: synthetic instances with a given number of tracks and ERB bands (10-100) are grounded and solved with every
+encoding. Masking pre-analysis time and possible masks, grounding time, ground program size, solving time,
+models per second and peak memory are recorded.
+Analysis: synthetic stereo tracks (white noise) are analyzed. Spectrum and ERB times and peak memory are recorded.
+Startup: time to import aspeq in a new interpreter, and whether the heavy modules (librosa, matplotlib, scipy) are imported.
+Every case runs in a fresh process, so the peak memory (max RSS) of a case does not depend on the previous ones.
+"""
+
+# Imports
+import sys
+import os
+import json
+import time
+import random
+import argparse
+import resource
+import tempfile
+import subprocess
+import multiprocessing
+
+"""
+Comma separated list of ints, e.g. 2,4,8
+"""
+def int_list(value):
+    return [int(v) for v in value.split(",")]
+
+"""
+Parse Arguments
+"""
+def parse_params():
+    parser = argparse.ArgumentParser(prog='benchmark_suite.py',
+                                     description="Benchmark the encodings and the analysis on synthetic data.")
+    parser.add_argument("--tracks", type=int_list, default=[2,4,8],
+                        help="Comma separated numbers of tracks. Default: 2,4,8")
+    parser.add_argument("--erb", type=int_list, default=[10,40,100],
+                        help="Comma separated numbers of ERB bands (10-100). Default: 10,40,100")
+    parser.add_argument("--encodings", type=str, default="lp/eq.lp,lp/eq_opt.lp",
+                        help="Comma separated encodings. Default: lp/eq.lp,lp/eq_opt.lp")
+    parser.add_argument("--masking-factor", type=float, default=0.5,
+                        help="Masking factor (0-1). Default: 0.5")
+    parser.add_argument("--essential-threshold", type=float, default=0.8,
+                        help="Threshold for essential ERB bands (0-1). Default: 0.8")
+    parser.add_argument("--models", type=int, default=100,
+                        help="Number of models enumerated per case. Default: 100")
+    parser.add_argument("--seed", type=int, default=0,
+                        help="Seed of the synthetic instances. Default: 0")
+    parser.add_argument("--analysis", action='store_true', default=False,
+                        help="Benchmark the analysis as well, on synthetic tracks.")
+    parser.add_argument("--duration", type=float, default=30,
+                        help="Duration in seconds of the synthetic tracks. Default: 30")
+    parser.add_argument("--samples", type=int, default=32768,
+                        help="FFT size of the analysis. Default: 32768")
+    parser.add_argument("--channels", type=str, default="mid", choices=["mid", "side", "left", "right", "max"],
+                        help="Channels of the analysis, as aspeq --channels. Default: mid")
+    parser.add_argument("--max-analysis-seconds", type=float, default=0,
+                        help="Seconds analyzed per track in segments of 10 s, as aspeq --max-analysis-seconds. Default: 0 = all")
+    parser.add_argument("--startup", type=int, default=0,
+                        help="Number of runs of the startup benchmark. Default: 0 = off")
+    parser.add_argument("--output", type=str, default=None,
+                        help="Write the results as JSON to this file.")
+    return parser.parse_args()
+
+"""
+Peak memory (max RSS) of the process in MB
+"""
+def peak_memory():
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    ## Bytes on macOS, KB elsewhere
+    return peak / (1024.0*1024.0) if sys.platform == "darwin" else peak / 1024.0
+
+"""
+Synthetic ERB amplitudes of tracks x bands. Each track has random amplitudes with a few loud (essential) bands.
+"""
+def synthetic_erbs(tracks, bands, threshold, seed):
+    rnd = random.Random(seed)
+    ## About 1 in 5 bands above the threshold
+    return [[rnd.uniform(threshold, 1.0) if rnd.random() < 0.2 else rnd.uniform(0.0, threshold) for band in range(bands)]
+            for track in range(tracks)]
+
+"""
+Synthetic instance with the same atoms as aspeq: erb_band/3 and essential_band/2.
+"""
+def synthetic_instance(erbs, threshold):
+    facts = []
+    for track, amplitudes in enumerate(erbs):
+        for band, amplitude in enumerate(amplitudes):
+            facts.append("erb_band(%s,%d,%d).\n"%(track+1, band+1, amplitude*100))
+            if amplitude >= threshold:
+                facts.append("essential_band(%s,%d).\n"%(track+1, band+1))
+    return "".join(facts)
+
+"""
+Ground and solve a synthetic instance with an encoding.
+The masking pre-analysis of aspeq is timed as well, with the number of shared bands and possible masks.
+"""
+def bench_encoding(encoding, tracks, bands, masking_factor, threshold, models, seed):
+    import clingo
+    from classes.observer import ProgramSizeObserver
+    from classes.masking import MaskingIndex
+
+    result = {"stage": "encoding", "encoding": encoding, "tracks": tracks, "erb": bands}
+    erbs = synthetic_erbs(tracks, bands, threshold, seed)
+    start = time.time()
+    index = MaskingIndex(erbs, threshold, int(masking_factor*100))
+    result["prepass_time"] = time.time() - start
+    result["shared_bands"] = int(index.shared.sum())
+    result["masks"] = len(index.masks())
+
+    control = clingo.Control(["--models=%s"%models, "--seed=%s"%seed, "--enum-mode=record"])
+    observer = ProgramSizeObserver()
+    control.register_observer(observer)
+    control.load(encoding)
+    control.add("base", [], synthetic_instance(erbs, threshold))
+    control.add("p", [], "masking_factor(%s)."%int(masking_factor*100))
+
+    start = time.time()
+    control.ground([("base", []), ("p", [])])
+    result["ground_time"] = time.time() - start
+    result["ground_memory"] = peak_memory()
+    result.update(observer.summary())
+
+    found = [0]
+    def on_model(model):
+        found[0] += 1
+    start = time.time()
+    solve_result = control.solve(on_model=on_model)
+    result["solve_time"] = time.time() - start
+    result["solve_memory"] = peak_memory()
+    result["result"] = str(solve_result)
+    result["models"] = found[0]
+    result["models_per_sec"] = found[0]/result["solve_time"] if result["solve_time"] > 0 else None
+    return result
+
+"""
+Analyze a synthetic track (white noise) of duration seconds
+"""
+def bench_analysis(duration, N, bands, seed, channels="mid", max_seconds=0):
+    import numpy as np
+    from scipy.io import wavfile
+    from classes import audio_features as af
+
+    sr = 44100
+    result = {"stage": "analysis", "duration": duration, "samples": N, "erb": bands, "channels": channels, "max_seconds": max_seconds}
+    rnd = np.random.RandomState(seed)
+    with tempfile.TemporaryDirectory() as path:
+        track_name = os.path.join(path, "noise")
+        wavfile.write(track_name+".wav", sr, (rnd.uniform(-0.5, 0.5, (int(duration*sr), 2))*32767).astype(np.int16))
+
+        start = time.time()
+        spectrum, len_signal = af.get_spectrum(track_name, float(sr), N, N, int(N/64), None, channels, max_seconds)
+        result["spectrum_time"] = time.time() - start
+        result["spectrum_memory"] = peak_memory()
+
+        start = time.time()
+        af.get_erb_bands(spectrum, len_signal, float(sr), bands, 20, sr/2.0)
+        result["erb_time"] = time.time() - start
+        result["erb_memory"] = peak_memory()
+    return result
+
+"""
+Import aspeq in a new interpreter, as a solve-only run does before parsing its arguments
+"""
+def bench_startup():
+    script = ("import sys, time, json; start = time.time(); import aspeq; elapsed = time.time() - start; "
+              "print(json.dumps([elapsed, [m for m in ['librosa', 'matplotlib', 'scipy'] if m in sys.modules]]))")
+    start = time.time()
+    output = subprocess.check_output([sys.executable, "-c", script], cwd=os.path.dirname(os.path.abspath(__file__)))
+    total = time.time() - start
+    elapsed, heavy = json.loads(output.decode("utf-8").strip().splitlines()[-1])
+    return {"stage": "startup", "import_time": float(elapsed), "interpreter_time": total, "heavy_modules": heavy}
+
+"""
+Main function
+"""
+def main():
+    args = parse_params()
+    for bands in args.erb:
+        if bands < 10 or bands > 100:
+            raise ValueError("""Number of erb bands requested is out of bounds""")
+
+    results = []
+    ## A new process per case
+    pool = multiprocessing.Pool(processes=1, maxtasksperchild=1)
+
+    print("Encoding         Tracks  ERB  Prepass (s)  Masks  Ground (s)    Atoms    Rules  Solve (s)  Models  Models/s  Memory (MB)")
+    for encoding in args.encodings.split(","):
+        for tracks in args.tracks:
+            for bands in args.erb:
+                result = pool.apply(bench_encoding, (encoding, tracks, bands, args.masking_factor,
+                                                     args.essential_threshold, args.models, args.seed))
+                results.append(result)
+                print("%-16s %6d %4d %12.4f %6d %11.3f %8d %8d %10.3f %7d %9.1f %12.1f"%(
+                      encoding, tracks, bands, result["prepass_time"], result["masks"], result["ground_time"], result["atoms"],
+                      result["rules"] + result["weight_rules"], result["solve_time"], result["models"],
+                      result["models_per_sec"] or 0, result["solve_memory"]))
+
+    if args.analysis:
+        print("")
+        print("ERB  Spectrum (s)  ERB (s)  Memory (MB)")
+        for bands in args.erb:
+            result = pool.apply(bench_analysis, (args.duration, args.samples, bands, args.seed, args.channels, args.max_analysis_seconds))
+            results.append(result)
+            print("%3d %13.3f %8.3f %12.1f"%(bands, result["spectrum_time"], result["erb_time"], result["erb_memory"]))
+
+    pool.close()
+    pool.join()
+
+    if args.startup > 0:
+        print("")
+        print("Run  Import (s)  Interpreter (s)  Heavy modules")
+        for run in range(args.startup):
+            result = bench_startup()
+            results.append(result)
+            print("%3d %11.3f %16.3f  %s"%(run+1, result["import_time"], result["interpreter_time"], ",".join(result["heavy_modules"]) or "-"))
+
+    if args.output is not None:
+        with open(args.output, "w") as f:
+            json.dump(results, f, indent=2)
+
+
+"""
+Main function
+"""
+if __name__ == '__main__':
+    sys.exit(main())
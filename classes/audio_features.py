@@ -10,52 +10,132 @@ flavio.everardo@cs.uni-potsdam.de
 """
 
 ## Imports
+## librosa and matplotlib are slow to import, they are imported on first use (get_spectrum, build_graphics)
+## so solving cached instances does not pay for them
 import numpy as np
-from librosa import load, stft, magphase
 from . import erb as erb
-from math import ceil, log, sqrt
+from .wav import WavFile
+from .profiler import StageTimer
+from math import log, sqrt
 import os
-import matplotlib
-#from sys import platform
-#if platform == "linux" or platform == "linux2":
-    # Linux
-#    matplotlib.use('agg')
-#elif platform == "darwin":
-    # OS X
-matplotlib.use('agg')
-import matplotlib.pyplot as plt
+import json
+from concurrent.futures import ProcessPoolExecutor
+from multiprocessing import Process
 
 
+## STFT frames per batch of the streaming spectrum when no batch size is given
+STREAMING_BATCH = 64
+
+"""
+Scale values so their maximum is 1. Silent signals (e.g. the side of a stem with identical channels)
+have no maximum and are returned as they are, all zeros.
+"""
+def normalize(values):
+    values = np.asarray(values, dtype=float)
+    peak = np.max(values) if values.size else 0
+    return values/peak if peak > 0 else values
+
 """
-Load wav file and get spectral information
+Load wav file (memory mapped, mono) and get spectral information.
+If batch is given, the spectrum is computed in streaming mode (see get_spectrum_streaming),
+which is also used for the other channel modes and to analyze sampled segments of long tracks.
 """
-def get_spectrum(track_name, sr, N, M, H):
+def get_spectrum(track_name, sr, N, M, H, batch=None, channels="mid", max_seconds=0, segment=10):
+    if batch or channels != "mid" or max_seconds > 0:
+        return get_spectrum_streaming(track_name, sr, N, M, H, batch or STREAMING_BATCH, channels, max_seconds, segment)
+    from librosa import stft, magphase
     W  = np.hanning(M) # Window Type
     ## Load WAV File
-    track,sr = load(track_name+'.wav', sr = sr, mono = 'True')
+    track = WavFile(track_name+'.wav').samples(sr)
     ## Perform Short Term Fourier Transform
     stft_ = stft(y = track, n_fft = N,win_length=M, hop_length=H, window = 'hann')
     ## Magnitudes (excluding phase)
     magnitude, _ = magphase(stft_)
     magnitude = magnitude / np.sum(W) #normalising STFT output
     ## Spectrum Average
-    spec_avg = np.average(magnitude,axis=1) 
-    spec_avg = spec_avg/np.max(spec_avg)
+    spec_avg = normalize(np.average(magnitude,axis=1))
+    len_signal = spec_avg.shape[0] # filter bank length
+
+    return spec_avg, len_signal
+
+"""
+Streaming version of get_spectrum.
+Frames are taken exactly as librosa's centered stft (zero padding of N/2 at both ends),
+but only batch frames are transformed at once and a running sum of magnitudes is kept.
+Peak memory is bounded by the batch size instead of the track length.
+channels = mid (average of the channels), side, left, right, or max: every channel is analyzed on its own
+and the spectrum is the maximum of theirs per bin, so sources panned to one side are not attenuated.
+If max_seconds is given, tracks longer than that are analyzed over evenly spaced segments of segment seconds,
+each one framed as a signal of its own, so the cost of the analysis does not grow with the track length.
+"""
+def get_spectrum_streaming(track_name, sr, N, M, H, batch, channels="mid", max_seconds=0, segment=10):
+    W = np.hanning(M) # Window Type
+    ## Periodic hann window centered in the FFT frame, as used by librosa
+    window = np.zeros(N)
+    offset = (N - M) // 2
+    window[offset:offset+M] = np.hanning(M + 1)[:-1]
+
+    wav = WavFile(track_name+'.wav')
+    signals = wav.channel_count(channels)
+    mag_sum = np.zeros((signals, N // 2 + 1))
+    frames = 0
+    ## Samples needed for a full batch of frames
+    span = N + (batch - 1) * H
+    for start, stop in wav.segments(max_seconds, segment):
+        buffer = np.zeros((signals, N // 2))
+        blocks = wav.channel_blocks(sr, span, channels, start, stop)
+        padded = False
+        while True:
+            while buffer.shape[1] < span and not padded:
+                block = next(blocks, None)
+                if block is None:
+                    ## End of the segment, pad as the centered stft does
+                    block = np.zeros((signals, N // 2))
+                    padded = True
+                buffer = np.concatenate((buffer, block), axis=1)
+            n_frames = min(batch, 1 + (buffer.shape[1] - N) // H) if buffer.shape[1] >= N else 0
+            if n_frames == 0:
+                break
+            ## Windowed FFT of a batch of frames of every signal
+            idx = np.arange(N)[None, :] + H * np.arange(n_frames)[:, None]
+            magnitude = np.abs(np.fft.rfft(buffer[:, idx] * window, axis=-1))
+            mag_sum += np.sum(magnitude, axis=1)
+            frames += n_frames
+            buffer = buffer[:, n_frames * H:]
+
+    ## Spectrum Average
+    spec_avg = np.max(mag_sum, axis=0) / max(frames, 1) / np.sum(W) #normalising STFT output
+    spec_avg = normalize(spec_avg)
     len_signal = spec_avg.shape[0] # filter bank length
 
     return spec_avg, len_signal
 
 """
-Build ERB bands wrt the spectral information
+Build ERB bands wrt the spectral information.
+weighting = bin: amplitude of the spectrum at the center frequency of each band, energy: see get_erb_energies
+If sparse, the filter bank is built and applied as a sparse matrix.
+"""
+def get_erb_bands(spec_avg, len_signal, sr, B, low_lim, high_lim, weighting="bin", sparse=False):
+    # Get bandwidths, frequencies, center frequencies and filters of the bank
+    bandwidths, freqs, center_freqs, filters, freqs_index = get_erb_bank(len_signal, sr, B, low_lim, high_lim, sparse)
+
+    # Get amplitudes wrt the ERB/Center Freq or the energy in the filter of each band
+    if weighting == "energy":
+        erb_amp = get_erb_energies(spec_avg, filters)
+    else:
+        erb_amp = get_erb_amplitudes(spec_avg, freqs_index)
+
+    return erb_amp, bandwidths, freqs, center_freqs, filters
+
+"""
+Build the ERB filter bank. It only depends on the spectrum length and the ERB parameters,
+so the bank is memoized and shared by all the tracks of a project.
+If sparse, the filters are returned as a scipy.sparse matrix.
 """
-def get_erb_bands(spec_avg, len_signal, sr, B, low_lim, high_lim):
+def get_erb_bank(len_signal, sr, B, low_lim, high_lim, sparse=False):
     # Equivalent Rectangular Bandwidth
-    # Create an instance of the ERB filter bank class
-    erb_bank = erb.EquivalentRectangularBandwidth(len_signal, sr, B, low_lim, high_lim)
-    
-    # Get ERB Bands and convert them to integer
-    erb_bands = erb_bank.erb_bands
-    erb_bands = list(map(int, erb_bands))
+    # Get the (memoized) instance of the ERB filter bank class
+    erb_bank = erb.get_filter_bank(len_signal, sr, B, low_lim, high_lim, sparse)
 
     # Get frequencies indexes
     freqs_index = erb_bank.freq_index
@@ -68,21 +148,155 @@ def get_erb_bands(spec_avg, len_signal, sr, B, low_lim, high_lim):
     # Get the filters
     filters = erb_bank.filters
 
-    # Get amplitudes wrt the ERB/Center Freq
+    return bandwidths, freqs, center_freqs, filters, freqs_index
+
+"""
+Get the normalized amplitudes of the spectrum wrt the ERB/Center Freq indexes
+"""
+def get_erb_amplitudes(spec_avg, freqs_index):
     erb_amp = []
     for i in range(len(freqs_index)):
         erb_amp.append(spec_avg[freqs_index[i]])
 
     ## Normalize ERBs amplitude
-    max_erb_amp = max(erb_amp)
-    erb_amp = erb_amp/max_erb_amp
+    return normalize(erb_amp)
 
-    return erb_amp, bandwidths, freqs, center_freqs, filters
+"""
+Get the normalized RMS of the spectrum weighted by the filter of each ERB band, all the bands in one matrix product.
+Unlike the center frequency amplitudes, every bin of the band counts.
+"""
+def get_erb_energies(spec_avg, filters):
+    ## Band filters only, without the lowpass and highpass of the bank
+    weights = filters[:len(spec_avg), 1:-1]
+    weights = weights.multiply(weights) if hasattr(weights, "multiply") else np.square(weights)
+    spectrum = np.asarray(spec_avg)[:weights.shape[0]]
+    energy = np.asarray(weights.T.dot(np.square(spectrum))).ravel()
+    norm = np.asarray(weights.sum(axis=0)).ravel()
+    erb_amp = np.sqrt(np.where(norm > 0, energy/np.where(norm > 0, norm, 1), 0))
+
+    ## Normalize ERBs amplitude
+    return normalize(erb_amp)
 
 """
-Plot and save graphics
+Cache keys of the spectrum and of the ERB amplitudes of a track for each number of bands in bands
 """
-def build_graphics(freqs, spec_avg, project_path, project_name, erbs, B, filters, tracks, show_plot):
+def analysis_keys(track_name, sr, N, M, H, bands, low_lim, high_lim, weighting, cache, channels="mid", max_seconds=0, segment=10):
+    wav = track_name+'.wav'
+    ## Entries of the whole track mid spectrum and of the center frequency amplitudes keep their keys
+    spectrum = () if channels == "mid" and max_seconds <= 0 else (channels, max_seconds, segment)
+    extra = spectrum if weighting == "bin" else spectrum + (weighting,)
+    return (cache.key("spectrum", wav, sr, N, M, H, *spectrum),
+            dict((B, cache.key("erb", wav, sr, N, M, H, B, low_lim, high_lim, *extra)) for B in bands))
+
+"""
+Whether the spectrum and the ERB amplitudes of a track are all in the cache
+"""
+def is_cached(track_name, sr, N, M, H, bands, low_lim, high_lim, weighting, cache, channels="mid", max_seconds=0, segment=10):
+    if cache is None:
+        return False
+    spec_key, erb_keys = analysis_keys(track_name, sr, N, M, H, bands, low_lim, high_lim, weighting, cache, channels, max_seconds, segment)
+    return all(os.path.exists(cache.entry(key)) for key in [spec_key] + list(erb_keys.values()))
+
+"""
+Get the average spectrum, the ERB amplitudes of a track for each number of bands in bands, and the stages that ran (stft, erb) as dict stage -> {"calls", "time"}.
+Stages answered from the cache do not run and are left out.
+The STFT is computed once for all the numbers of bands.
+If an analysis cache is given, results are taken from it and the audio is only decoded on a miss.
+channels, max_seconds and segment are the options of the spectrum (see get_spectrum_streaming), sparse the one of the filter bank.
+If profile_dir is given, the stages are profiled and dumped as <stage>_<track>.prof, also from worker processes.
+"""
+def analyze_track(track_name, sr, N, M, H, batch, bands, low_lim, high_lim, cache=None, weighting="bin",
+                  channels="mid", max_seconds=0, segment=10, sparse=False, profile_dir=None):
+    spec_avg = None
+    erb_amps = {}
+    timer = StageTimer(profile_dir, os.path.basename(track_name))
+    if cache is not None:
+        spec_key, erb_keys = analysis_keys(track_name, sr, N, M, H, bands, low_lim, high_lim, weighting, cache,
+                                           channels, max_seconds, segment)
+        entry = cache.load(spec_key)
+        if entry is not None:
+            spec_avg = entry["spec_avg"]
+        for B, erb_key in erb_keys.items():
+            entry = cache.load(erb_key)
+            if entry is not None:
+                erb_amps[B] = entry["erb_amp"]
+
+    if spec_avg is None:
+        with timer.stage("stft"):
+            spec_avg, _ = get_spectrum(track_name, sr, N, M, H, batch, channels, max_seconds, segment)
+        if cache is not None:
+            cache.save(spec_key, spec_avg=spec_avg)
+
+    for B in bands:
+        if B not in erb_amps:
+            with timer.stage("erb"):
+                erb_amps[B], _, _, _, _ = get_erb_bands(spec_avg, len(spec_avg), sr, B, low_lim, high_lim, weighting, sparse)
+            if cache is not None:
+                cache.save(erb_keys[B], erb_amp=erb_amps[B])
+
+    timer.dump_profiles()
+    return spec_avg, erb_amps, timer.report()["stages"]
+
+"""
+Analyze a list of tracks with analyze_track, fanned out over a pool of jobs processes.
+Tracks already in the cache are only loaded, in this process, so the pool only gets the new or modified ones.
+Results are returned in the order of track_names.
+"""
+def analyze_tracks(track_names, sr, N, M, H, batch, bands, low_lim, high_lim, cache=None, jobs=1, weighting="bin",
+                   channels="mid", max_seconds=0, segment=10, sparse=False, profile_dir=None):
+    options = (weighting, channels, max_seconds, segment, sparse, profile_dir)
+    pending = [track_name for track_name in track_names
+               if not is_cached(track_name, sr, N, M, H, bands, low_lim, high_lim, weighting, cache, channels, max_seconds, segment)]
+    if jobs <= 1 or len(pending) <= 1:
+        for track_name in track_names:
+            yield analyze_track(track_name, sr, N, M, H, batch, bands, low_lim, high_lim, cache, *options)
+        return
+
+    with ProcessPoolExecutor(max_workers=min(jobs, len(pending))) as pool:
+        futures = dict((track_name, pool.submit(analyze_track, track_name, sr, N, M, H, batch, bands, low_lim, high_lim, cache, *options))
+                       for track_name in pending)
+        for track_name in track_names:
+            if track_name in futures:
+                yield futures[track_name].result()
+            else:
+                yield analyze_track(track_name, sr, N, M, H, batch, bands, low_lim, high_lim, cache, *options)
+
+"""
+Indexes of about points frequencies, log spaced as the spectrums are plotted on a log frequency axis
+"""
+def plot_indexes(length, points):
+    return np.unique(np.concatenate(([0], np.round(np.geomspace(1, length-1, points)).astype(int))))
+
+"""
+Downsample the frequencies, the spectrums and the filter bank to about points frequencies (0 = full resolution).
+Each plotted spectrum value is the maximum of the bins it stands for, so the peaks are kept.
+"""
+def decimate_graphics(freqs, spec_avg, filters, points):
+    if points <= 0 or points >= len(freqs):
+        return freqs, spec_avg, filters
+    indexes = plot_indexes(len(freqs), points)
+    freqs = np.asarray(freqs)[indexes]
+    spec_avg = [np.maximum.reduceat(spectrum, indexes) for spectrum in spec_avg]
+    filters = filters[indexes]
+    return freqs, spec_avg, filters
+
+"""
+Plot and save graphics. The spectrums are downsampled to points frequencies (0 = full resolution)
+"""
+def build_graphics(freqs, spec_avg, project_path, project_name, erbs, B, filters, tracks, show_plot, points=0):
+    import matplotlib
+    #from sys import platform
+    #if platform == "linux" or platform == "linux2":
+        # Linux
+    #    matplotlib.use('agg')
+    #elif platform == "darwin":
+        # OS X
+    matplotlib.use('agg')
+    import matplotlib.pyplot as plt
+    freqs, spec_avg, filters = decimate_graphics(freqs, spec_avg, filters, points)
+    ## Sparse filter banks are expanded for plotting
+    if hasattr(filters, "toarray"):
+        filters = filters.toarray()
     ## Plot
     plt.figure(figsize=(12,7))
     plt.subplot(311)
@@ -106,8 +320,7 @@ def build_graphics(freqs, spec_avg, project_path, project_name, erbs, B, filters
     plt.subplot(313)
     plt.grid(True)
     for i in range(len(erbs)):
-        erbs[i] = np.insert(erbs[i], 0, 0)
-        plt.plot(erbs[i], label=tracks[i])
+        plt.plot(np.insert(erbs[i], 0, 0), label=tracks[i])
     plt.title(project_name+" ERB Scale")
     plt.xlabel('ERB Numbers (1-%s)'%B)
     plt.ylabel('Power Ratio [0-1]')
@@ -118,6 +331,21 @@ def build_graphics(freqs, spec_avg, project_path, project_name, erbs, B, filters
     plt.savefig('%s/%s.png'%(project_path, project_name))
     if show_plot:
         plt.show()
+    plt.close()
+
+"""
+Plot and save graphics in a separate process, which is returned so the caller can join it.
+The process gets copies of the (downsampled) data, the caller may go on with the analysis data.
+"""
+def build_graphics_background(freqs, spec_avg, project_path, project_name, erbs, B, filters, tracks, points=0):
+    freqs, spec_avg, filters = decimate_graphics(freqs, spec_avg, filters, points)
+    if hasattr(filters, "toarray"):
+        filters = filters.toarray()
+    process = Process(target=build_graphics,
+                      args=(np.array(freqs), [np.array(spectrum) for spectrum in spec_avg], project_path, project_name,
+                            [np.array(erb_amp) for erb_amp in erbs], B, np.array(filters), list(tracks), False))
+    process.start()
+    return process
 
 """
 Build ASP Instances wrt the tracks in the project. 
@@ -127,12 +355,23 @@ def build_asp_instance(file_handle, track_id, instance, erb_bands, threshold):
     file_handle.write("%% Instance: %s\n\n"%(instance))
     file_handle.write("%% erb_band(track id, erb band, amplitude *100).\n")
     file_handle.write("%% essential_erb(track id, erb band).\n")
+    file_handle.write(build_asp_facts(track_id, erb_bands, threshold))
+
+"""
+Build the atoms erb_band/3 and essential_band/2 of a track as a program string,
+to be written in an instance file or added directly to a clingo control object.
+If bands is given (a bool per band, see MaskingIndex.involved), erb_band/3 is only built for those bands.
+"""
+def build_asp_facts(track_id, erb_bands, threshold, bands=None):
+    facts = []
     for i in range(len(erb_bands)):
-        file_handle.write("erb_band(%s,%d,%d).\n"%(track_id, i+1, erb_bands[i]*100 ))
+        if bands is None or bands[i]:
+            facts.append("erb_band(%s,%d,%d).\n"%(track_id, i+1, erb_bands[i]*100 ))
         #Normalize
         if erb_bands[i] >= threshold:
             # Essential frequency band for ASP instance
-            file_handle.write("essential_band(%s,%d).\n"%(track_id,i+1))
+            facts.append("essential_band(%s,%d).\n"%(track_id,i+1))
+    return "".join(facts)
 
 
 """ 
@@ -148,32 +387,66 @@ def amp2db(amp): # dB = 20 * log10(amplitude)
     dB = 20*(log(amp,10))
     return dB
 
+"""
+Build the atoms db_change/3 for the optimization, the change in tenths of dB between every pair of power ratios (*100).
+A power ratio of 0 is taken as 1 (-20 dB).
+"""
+def build_asp_db_table():
+    facts = []
+    for p in range(0, 101):
+        start_db = amp2db(sqrt(max(p, 1)/100.0))
+        for n in range(1, 101):
+            goal_db = amp2db(sqrt(n/100.0))
+            facts.append("db_change(%d,%d,%d).\n"%(p, n, int(round(abs(goal_db - start_db)*10))))
+    return "".join(facts)
 
 """
-Parse Answer Sets and return information for csound parsing
+Parse Answer Sets and return information for csound parsing.
+The cut/5 and boost/5 atoms are decoded from the symbols (no string conversion), and the dB changes
+and Q factors of all of them are computed at once.
+tracks = dict track id -> name of the stem (see ProjectManifest.names)
+Return the EQs of the answer wrt the track id: [track, frequency (Hz), gain (dB), Q]
 """
 def parse_answer_sets_to_plan(file, tracks, answers, center_freqs, bandwidths):
     eqs = {}
+    ops = []
+    rows = []
     for atom in answers:
-        if str(atom).startswith("cut(") or str(atom).startswith("boost("):
-            track    = int(str(atom.arguments[0]))-1
-            index    = int(str(atom.arguments[1]))
-            freq     = center_freqs[index-1]
-            start_db = amp2db(sqrt(int(str(atom.arguments[2]))/100.0))
-            goal_db  = amp2db(sqrt(int(str(atom.arguments[4]))/100.0))
-            diff_db  = abs(goal_db - start_db)
-            eq_op    = atom.name
-            bandw    = bandwidths[index-1]
-            q_factor = freq/bandw
-
-            plan_line = "%s:%s %s Hz, %s, %.1f dB  Q %.2f"%(track+1, tracks[track], int(ceil(freq)), eq_op, diff_db, q_factor)#, start_db, goal_db)
-            print(plan_line)
-            file.write(plan_line+"\n")
-
-            if str(eq_op) == "cut":
-                eqs.setdefault(track+1, []).append([tracks[track], int(ceil(freq)), float("%.1f"%(-diff_db)), float("%.2f"%q_factor)])
-            elif str(eq_op) == "boost":
-                eqs.setdefault(track+1, []).append([tracks[track], int(ceil(freq)), float("%.1f"%( diff_db)), float("%.2f"%q_factor)])
+        if atom.name == "cut" or atom.name == "boost":
+            arguments = atom.arguments
+            ops.append(atom.name)
+            ## Track id, band, amplitude before and after the EQ *100
+            rows.append((arguments[0].number, arguments[1].number, arguments[2].number, arguments[4].number))
+    if not rows:
+        return eqs
+
+    rows = np.array(rows)
+    index = rows[:, 1] - 1
+    freqs = np.asarray(center_freqs)[index]
+    ## amp2db(sqrt(p/100)) = 10*log10(p/100)
+    diff_db = np.abs(10*np.log10(rows[:, 3]/100.0) - 10*np.log10(rows[:, 2]/100.0))
+    q_factors = freqs/np.asarray(bandwidths)[index]
+    gains = np.round(np.where(np.array(ops) == "cut", -diff_db, diff_db), 1).tolist()
+    q_rounded = np.round(q_factors, 2).tolist()
+    freqs = np.ceil(freqs).astype(int).tolist()
+
+    plan = []
+    for i, eq_op in enumerate(ops):
+        track = int(rows[i, 0])
+        plan.append("%s:%s %s Hz, %s, %.1f dB  Q %.2f"%(track, tracks[track], freqs[i], eq_op, diff_db[i], q_factors[i]))
+        eqs.setdefault(track, []).append([tracks[track], freqs[i], gains[i], q_rounded[i]])
+    print("\n".join(plan))
+    file.write("".join(plan_line+"\n" for plan_line in plan))
 
     return eqs
-        
+
+"""
+Read the EQs of the answers of a plan written as JSON Lines (see aspeq.Results).
+Yield the answer number, the Csound file of its mixdown and its EQs wrt the track id, as returned by parse_answer_sets_to_plan
+"""
+def read_plan(file_name):
+    with open(file_name) as f:
+        for line in f:
+            if line.strip():
+                record = json.loads(line)
+                yield record["answer"], record["csd"], dict((int(track), eqs) for track, eqs in record["eqs"].items())
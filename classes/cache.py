@@ -0,0 +1,105 @@
+"""
+Content addressed on-disk cache for the audio analysis (average spectrums and ERB amplitudes).
+
+Entries are compressed .npz files named after a hash of the track content and the analysis parameters,
+so a modified stem or a different STFT/ERB setting never hits a stale entry.
+"""
+
+import os
+import hashlib
+import tempfile
+import numpy as np
+
+class AnalysisCache(object):
+    """
+    path = directory where the entries are stored (e.g. projects/<name>/.cache)
+    max_size = maximum size of the cache in bytes. The least recently used entries are evicted first
+    """
+    def __init__(self, path, max_size):
+        self.path = path
+        self.max_size = max_size
+        self.hashes = {}
+        if not os.path.exists(path):
+            os.makedirs(path)
+
+    def file_hash(self, file_name):
+        """
+        Hash of the file content. Computed once per file and cache instance
+        """
+        if file_name not in self.hashes:
+            sha = hashlib.sha1()
+            with open(file_name, "rb") as f:
+                for chunk in iter(lambda: f.read(1 << 20), b""):
+                    sha.update(chunk)
+            self.hashes[file_name] = sha.hexdigest()
+        return self.hashes[file_name]
+
+    def forget(self, file_name):
+        """
+        Forget the hash of a file whose content changed
+        """
+        self.hashes.pop(file_name, None)
+
+    def key(self, kind, file_name, *params):
+        """
+        Key of an entry wrt the kind of data, the file content and the analysis parameters
+        """
+        params = ",".join(repr(p) for p in params)
+        digest = hashlib.sha1(("%s|%s" % (self.file_hash(file_name), params)).encode("utf-8")).hexdigest()
+        return "%s_%s" % (kind, digest)
+
+    def entry(self, key):
+        return os.path.join(self.path, key + ".npz")
+
+    def load(self, key):
+        """
+        Return the dict of arrays stored under key or None if not cached
+        """
+        entry = self.entry(key)
+        if not os.path.exists(entry):
+            return None
+        try:
+            with np.load(entry) as data:
+                arrays = dict((name, data[name]) for name in data.files)
+            ## Entries with NaN (e.g. written by versions that normalized silent spectrums) are recomputed
+            if any(np.issubdtype(array.dtype, np.floating) and not np.all(np.isfinite(array)) for array in arrays.values()):
+                return None
+            ## Mark as recently used
+            os.utime(entry, None)
+        except (IOError, OSError, ValueError, EOFError):
+            ## Evicted meanwhile or corrupted entry
+            return None
+        return arrays
+
+    def save(self, key, **arrays):
+        """
+        Store the arrays under key and evict old entries if the cache grows too large
+        """
+        handle, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(handle, "wb") as f:
+            np.savez_compressed(f, **arrays)
+        os.replace(tmp, self.entry(key))
+        self.evict()
+
+    def evict(self):
+        """
+        Remove the least recently used entries until the cache fits in max_size
+        """
+        ## Entries may be added or removed concurrently by other analysis processes
+        entries = []
+        for fl in os.listdir(self.path):
+            if fl.endswith(".npz"):
+                try:
+                    stat = os.stat(os.path.join(self.path, fl))
+                except OSError:
+                    continue
+                entries.append((stat.st_mtime, stat.st_size, fl))
+        total = sum(size for _, size, _ in entries)
+        for _, size, fl in sorted(entries):
+            if total <= self.max_size:
+                break
+            try:
+                os.remove(os.path.join(self.path, fl))
+            except OSError:
+                pass
+            total -= size
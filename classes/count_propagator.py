@@ -0,0 +1,189 @@
+"""
+XOR constraints propagator for near-uniform sampling of EQ configurations.
+
+Every solving step adds s random XOR (parity) constraints over the cut/5 and boost/5 atoms, each atom taking part
+in a constraint with probability q. The constraints split the answer sets into about 2^s cells of similar size
+and a random cell is picked, so the first answer found is a near-uniform sample without enumerating all of them.
+
+The constraints are kept as rows (bitmask over the atoms, parity) of a linear system over GF(2),
+reduced with Gauss-Jordan elimination at init and wrt the unassigned atoms during propagation.
+"""
+
+import random
+import hashlib
+
+def popcount(mask):
+    return bin(mask).count("1")
+
+def lowest_bit(mask):
+    return (mask & -mask).bit_length() - 1
+
+def bits(mask):
+    """
+    Indexes of the bits set in mask
+    """
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+def gauss_jordan(rows, columns=-1):
+    """
+    Reduce the rows (bitmask, parity) wrt the given columns (bitmask, default all).
+    Return the reduced rows with a pivot and the rows left without columns (they only have bits outside columns).
+    """
+    reduced = []
+    rest = []
+    for mask, parity in rows:
+        for pivot, (pivot_mask, pivot_parity) in reduced:
+            if mask >> pivot & 1:
+                mask ^= pivot_mask
+                parity ^= pivot_parity
+        if mask & columns:
+            pivot = lowest_bit(mask & columns)
+            ## Remove the new pivot from the previous rows
+            for i, (other, (other_mask, other_parity)) in enumerate(reduced):
+                if other_mask >> pivot & 1:
+                    reduced[i] = (other, (other_mask ^ mask, other_parity ^ parity))
+            reduced.append((pivot, (mask, parity)))
+        else:
+            rest.append((mask, parity))
+    return [row for _, row in reduced], rest
+
+class Propagator(object):
+    """
+    s = number of XOR constraints
+    q = density, probability of an atom to be part of a constraint
+    signatures = atoms to sample over
+    literals = solver literals of the atoms, the columns of the constraints
+    rows = XOR constraints as (bitmask over literals, parity)
+    inconsistent = the constraints of the current step have no solution (0 = 1)
+    """
+    def __init__(self, s, q, signatures=(("cut", 5), ("boost", 5)), seed=None):
+        self.s = s
+        self.q = q
+        self.signatures = signatures
+        self.random = random.Random(seed)
+        self.literals = []
+        self.rows = []
+        self.inconsistent = False
+
+    def init(self, init):
+        """
+        Draw new XOR constraints, called before every solving step
+        """
+        columns = {}
+        self.literals = []
+        atoms = []
+        for name, arity in self.signatures:
+            for atom in init.symbolic_atoms.by_signature(name, arity):
+                literal = init.solver_literal(atom.literal)
+                if init.assignment.is_fixed(literal):
+                    ## Atoms fixed at the top level are constants of the constraints
+                    atoms.append((None, init.assignment.is_true(literal)))
+                    continue
+                ## A negative solver literal is the negation of the variable, flip the parity
+                if abs(literal) not in columns:
+                    columns[abs(literal)] = len(self.literals)
+                    self.literals.append(abs(literal))
+                atoms.append((columns[abs(literal)], literal < 0))
+
+        rows = []
+        for _ in range(self.s):
+            mask = 0
+            parity = self.random.randint(0, 1)
+            for column, flip in atoms:
+                if self.random.random() < self.q:
+                    if column is not None:
+                        mask ^= 1 << column
+                    parity ^= flip
+            rows.append((mask, parity))
+
+        self.rows, rest = gauss_jordan(rows)
+        ## 0 = 1, no answer in the chosen cell. Clauses added in init stay for the next steps,
+        ## the conflict is raised from check with a clause of this step only
+        self.inconsistent = any(parity for _, parity in rest)
+        if self.inconsistent:
+            return
+
+        ## Watch both signs of the atoms left in the constraints
+        used = 0
+        for mask, _ in self.rows:
+            used |= mask
+        for column in bits(used):
+            init.add_watch(self.literals[column])
+            init.add_watch(-self.literals[column])
+
+    def propagate(self, control, changes):
+        self.propagate_xors(control)
+
+    def check(self, control):
+        self.propagate_xors(control)
+
+    def propagate_xors(self, control):
+        """
+        Reduce the constraints wrt the unassigned atoms.
+        A row left without unassigned atoms is a conflict if its parity does not hold, a row with a single one implies it.
+        The reason of both is the assignment of the other atoms of the (reduced) row.
+        The clauses are tagged, so they are removed before the next solving step draws new constraints.
+        """
+        if self.inconsistent:
+            control.add_clause([], tag=True)
+            return
+        assignment = control.assignment
+        assigned = 0
+        value = 0
+        for column, literal in enumerate(self.literals):
+            truth = assignment.value(literal)
+            if truth is not None:
+                assigned |= 1 << column
+                if truth:
+                    value |= 1 << column
+
+        reduced, rest = gauss_jordan(self.rows, ~assigned)
+        for mask, parity in rest:
+            if popcount(mask & value) & 1 != parity:
+                control.add_clause(self.reason(mask, value), tag=True)
+                return
+
+        for mask, parity in reduced:
+            free = mask & ~assigned
+            if free & (free - 1):
+                continue
+            column = lowest_bit(free)
+            literal = self.literals[column]
+            if popcount(mask & value) & 1 == parity:
+                literal = -literal
+            clause = self.reason(mask ^ free, value) + [literal]
+            if not control.add_clause(clause, tag=True) or not control.propagate():
+                return
+
+    def reason(self, mask, value):
+        """
+        Clause falsified by the current assignment of the atoms in mask
+        """
+        return [-self.literals[column] if value >> column & 1 else self.literals[column] for column in bits(mask)]
+
+def sample(control, samples, attempts=None, on_model=None):
+    """
+    Solve once per sample for the first answer of a new random cell, until samples distinct answers are found
+    or attempts (default 10*samples) solving steps are done. Cells without answers are skipped.
+    Each distinct answer (shown symbols) is passed to on_model as soon as it is found, only a digest of it is kept.
+    Return the number of distinct answers.
+    """
+    if attempts is None:
+        attempts = 10*samples
+    seen = set()
+    control.configuration.solve.models = 1
+    for _ in range(attempts):
+        if len(seen) >= samples:
+            break
+        found = []
+        control.solve(on_model=lambda model: found.append(model.symbols(shown=True)))
+        for answer in found:
+            key = hashlib.sha1(" ".join(sorted(str(atom) for atom in answer)).encode("utf-8")).digest()
+            if key not in seen:
+                seen.add(key)
+                if on_model is not None:
+                    on_model(answer)
+    return len(seen)
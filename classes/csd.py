@@ -1,4 +1,8 @@
-import os
+import time
+import subprocess
+import threading
+from contextlib import nullcontext
+from concurrent.futures import ThreadPoolExecutor, wait as wait_futures
 
 def create_filters(csd_file, filters):
     f_count = 0
@@ -71,8 +75,75 @@ def create_footer(csd_file):
     csd_file.write("</CsScore>\n")
     csd_file.write("</CsoundSynthesizer>\n")
 
+"""
+Render a csound file to wav. Return the csound file, the exit status and the elapsed time in seconds.
+The output of csound is kept and printed only if the render fails.
+"""
 def render(path, csound_file):
-    print("render csound file to wav")
-    command = "csound %s/%s -O null"%(path,csound_file)
-    os.system(command)
+    print("render csound file to wav: %s"%csound_file)
+    start = time.time()
+    try:
+        process = subprocess.run(["csound", "%s/%s"%(path,csound_file), "-O", "null"],
+                                 stdout=subprocess.PIPE, stderr=subprocess.STDOUT)
+        status = process.returncode
+        output = process.stdout.decode("utf-8", "replace")
+    except OSError as error:
+        ## csound not installed or not executable
+        status = 127
+        output = str(error)
+    elapsed = time.time() - start
+    if status != 0:
+        print("csound failed for %s (exit status %s):\n%s"%(csound_file, status, output[-2000:]))
+    return csound_file, status, elapsed
+
+class Renderer(object):
+    """
+    Render csound files in the background, at most jobs at a time.
+    Each render waits for its csound process in a worker thread, so the answers can be rendered while solving.
+    Renders are reported as they finish and only the pending ones are kept.
+    pending = futures of the renders not finished yet
+    failed = number of failed renders
+    timer = optional profiler.StageTimer, each render is timed (and profiled) as the rendering stage of its thread
+    """
+    def __init__(self, jobs, timer=None):
+        self.pool = ThreadPoolExecutor(max_workers=jobs, thread_name_prefix="render")
+        self.pending = set()
+        self.failed = 0
+        self.timer = timer
+        self.lock = threading.Lock()
+
+    def render(self, path, csound_file, eqs):
+        """
+        Render path/csound_file. The filters (eqs) are already written in the csound file
+        """
+        return render(path, csound_file)
+
+    def run(self, path, csound_file, eqs):
+        with self.timer.stage("rendering") if self.timer is not None else nullcontext():
+            csound_file, status, elapsed = self.render(path, csound_file, eqs)
+        print("Rendered %s: exit status %s, %.1f secs"%(csound_file, status, elapsed))
+        if status != 0:
+            with self.lock:
+                self.failed += 1
+
+    def submit(self, path, csound_file, eqs=None):
+        future = self.pool.submit(self.run, path, csound_file, eqs)
+        with self.lock:
+            self.pending.add(future)
+        future.add_done_callback(self.done)
+
+    def done(self, future):
+        with self.lock:
+            self.pending.discard(future)
+
+    def wait(self):
+        """
+        Wait for all the submitted renders and return the number of failed ones
+        """
+        with self.lock:
+            pending = list(self.pending)
+        wait_futures(pending)
+        return self.failed
 
+    def close(self):
+        self.pool.shutdown()
@@ -0,0 +1,131 @@
+"""
+Decomposed solving of the encodings (lp/eq.lp, lp/eq_opt.lp) by ERB band.
+
+Masks, cuts, boosts and the masking after the EQ never link different bands. The only global rule is the choice
+of exactly one shared band (_essential_band/2 among shared_band/2), so the problem splits into independent parts:
+- the shared bands, one part per band, as alternatives of the choice
+- each band with a single essential track and possible masks (see MaskingIndex), combined with all the others
+Bands with a single essential track and no possible mask have a fixed answer (their _essential_band/2).
+The parts are solved in parallel processes, and their answers are combined lazily into the requested number of mixes.
+"""
+
+import random
+import itertools
+from concurrent.futures import ProcessPoolExecutor
+import clingo
+import numpy as np
+from classes.stats import solve_statistics
+
+## Parts without shared band get a placeholder, so the choice of the encodings has a single element.
+## Band 0 has no erb_band/3 facts, nothing else is derived from it
+PLACEHOLDER = "shared_band(0,0).\n"
+PLACEHOLDER_ATOM = "_essential_band(0,0)"
+
+"""
+Facts of a band for the tracks involved in its possible masks, with the masking factor
+"""
+def band_program(index, involved, band, masking_factor, placeholder=False):
+    facts = ["masking_factor(%s).\n"%masking_factor]
+    for track in range(index.essential.shape[0]):
+        if involved[track, band]:
+            facts.append("erb_band(%d,%d,%d).\n"%(index.ids[track], band+1, index.amplitudes[track, band]))
+        if index.essential[track, band]:
+            facts.append("essential_band(%d,%d).\n"%(index.ids[track], band+1))
+    if placeholder:
+        facts.append(PLACEHOLDER)
+    return "".join(facts)
+
+"""
+Split the problem of a masking index (for masking_factor *100) by band.
+Return the programs of the shared bands, the programs of the other bands with possible masks,
+and the fixed atoms of the bands without possible masks.
+"""
+def split(index, masking_factor):
+    involved = index.involved()
+    essential_tracks = np.sum(index.essential, axis=0)
+    shared, single, fixed = [], [], []
+    for band in range(index.essential.shape[1]):
+        if essential_tracks[band] >= 2:
+            shared.append(band_program(index, involved, band, masking_factor))
+        elif essential_tracks[band] == 1:
+            track = int(np.flatnonzero(index.essential[:, band])[0])
+            if np.any(index.candidates[:, track, band]):
+                single.append(band_program(index, involved, band, masking_factor, True))
+            else:
+                fixed.append("_essential_band(%d,%d)"%(index.ids[track], band+1))
+    return shared, single, fixed
+
+"""
+Ground and solve a part, return up to models answers (shown atoms as strings, 0 = all),
+whether the answers are exhausted and the statistics of the solve call
+"""
+def solve_part(clingo_args, encoding, program, models):
+    control = clingo.Control(clingo_args)
+    control.load(encoding)
+    control.add("base", [], program)
+    control.ground([("base", [])])
+    control.configuration.solve.models = models
+    answers = []
+    solve_result = control.solve(on_model=lambda model: answers.append(
+        [str(atom) for atom in model.symbols(shown=True) if str(atom) != PLACEHOLDER_ATOM]))
+    return answers, solve_result.exhausted, solve_statistics(control)
+
+"""
+Index tuples of distinct combinations of parts of the given sizes: all of them in order if mixes is 0
+or not smaller than their number, otherwise mixes random ones
+"""
+def combinations(sizes, mixes, rnd):
+    total = 1
+    for size in sizes:
+        total *= size
+    if mixes == 0 or mixes >= total:
+        for combination in itertools.product(*[range(size) for size in sizes]):
+            yield combination
+        return
+    seen = set()
+    while len(seen) < mixes:
+        combination = tuple(rnd.randrange(size) for size in sizes)
+        if combination not in seen:
+            seen.add(combination)
+            yield combination
+
+"""
+Solve the parts of a masking index with jobs processes and pass up to mixes combined answers (0 = all) to on_answer,
+as lists of symbols like the answers of a clingo model. arguments() returns the clingo arguments of a part.
+Return the number of answers, whether all the answers were combined, and the statistics summed over the parts.
+"""
+def solve(arguments, encoding, index, masking_factor, mixes, jobs, on_answer, seed=None):
+    shared, single, fixed = split(index, masking_factor)
+    programs = shared + single
+    ## Each part needs at most mixes answers for mixes combinations
+    tasks = [(arguments(), encoding, program, mixes) for program in programs]
+    if jobs <= 1 or len(tasks) <= 1:
+        results = [solve_part(*task) for task in tasks]
+    else:
+        with ProcessPoolExecutor(max_workers=min(jobs, len(tasks))) as pool:
+            results = list(pool.map(solve_part, *zip(*tasks)))
+
+    statistics = {"models": 0, "solve_time": 0.0, "choices": 0, "conflicts": 0, "parts": len(tasks)}
+    for _, _, part_statistics in results:
+        for key, value in part_statistics.items():
+            statistics[key] += value or 0
+    exhausted = all(part_exhausted for _, part_exhausted, _ in results)
+
+    ## The answers of the shared bands are alternatives, the ones of the other bands are combined with them
+    parts = [[answer for answers, _, _ in results[:len(shared)] for answer in answers]]
+    parts += [answers for answers, _, _ in results[len(shared):]]
+    if not all(parts):
+        return 0, exhausted, statistics
+
+    fixed = [clingo.parse_term(atom) for atom in fixed]
+    answers = 0
+    for combination in combinations([len(part) for part in parts], mixes, random.Random(seed)):
+        answer = list(fixed)
+        for part, i in zip(parts, combination):
+            answer.extend(clingo.parse_term(atom) for atom in part[i])
+        on_answer(answer)
+        answers += 1
+    total = 1
+    for part in parts:
+        total *= len(part)
+    return answers, exhausted and answers == total, statistics
@@ -9,6 +9,20 @@ flavio.everardo@cs.uni-potsdam.de
 """
 
 import numpy as np
+from functools import lru_cache
+
+@lru_cache(maxsize=16)
+def get_filter_bank(len_signal, sample_rate, total_erb_bands, low_lim, high_lim, sparse=False):
+    """
+    Memoized filter bank. All the tracks of a project share the same parameters, so the bank is built only once.
+    The arrays of the returned bank are read-only as the instance is shared.
+    """
+    erb_bank = EquivalentRectangularBandwidth(len_signal, sample_rate, total_erb_bands, low_lim, high_lim, sparse)
+    if not sparse:
+        erb_bank.filters.flags.writeable = False
+    erb_bank.freqs.flags.writeable = False
+    erb_bank.cutoffs.flags.writeable = False
+    return erb_bank
 
 class FilterBank(object):
     """
@@ -56,15 +70,16 @@ class EquivalentRectangularBandwidth(FilterBank):
     erb_high = highest erb band
     erb_lims = limits between erb bands
     cutoffs  = cuts between erb bands
+    sparse   = store the filters as a sparse (scipy.sparse CSC) matrix instead of a dense one
     """
-    def __init__(self, len_signal, sample_rate, total_erb_bands, low_lim, high_lim):
+    def __init__(self, len_signal, sample_rate, total_erb_bands, low_lim, high_lim, sparse=False):
         super(EquivalentRectangularBandwidth, self).__init__(len_signal, sample_rate, total_erb_bands, low_lim, high_lim)
         # Build evenly spaced cutoffs on an ERB Scale
         erb_low  = self.freq2erb(self.low_lim)
         erb_high = self.freq2erb(self.high_lim)
         erb_lims = np.linspace(erb_low, erb_high, self.total_erb_bands + 2)
         self.cutoffs = self.erb2freq(erb_lims)
-        self.filters = self.get_bands(self.total_erb_bands, self.nfreqs, self.freqs, self.cutoffs)
+        self.filters = self.get_bands(self.total_erb_bands, self.nfreqs, self.freqs, self.cutoffs, sparse)
         
     def freq2erb(self, freq_Hz):
         """
@@ -80,39 +95,65 @@ class EquivalentRectangularBandwidth(FilterBank):
         freq_Hz = (np.power(10,(n_erb/21.4))-1)/0.00437
         return freq_Hz
 
-    def get_bands(self, total_erb_bands, nfreqs, freqs, cutoffs):
+    def get_bands(self, total_erb_bands, nfreqs, freqs, cutoffs, sparse=False):
         """
-        Get the erb bands, indexes and bandwidths
+        Get the erb bands, indexes and bandwidths.
+        All the bands are computed at once, band limits are found with searchsorted over the frequency grid.
+        The filters are built from their non zero values, as a dense matrix or, if sparse, directly as a CSC matrix.
         """
-        cos_filts = np.zeros([nfreqs + 1, total_erb_bands])
-        for erb in range(total_erb_bands):
-            lower_cutoff   = cutoffs[erb]
-            higher_cutoff  = cutoffs[erb + 2]  # adjacent filters overlap by 50%
-            erb_center     = (self.freq2erb(lower_cutoff) + self.freq2erb(higher_cutoff)) / 2
-            freq_bandwidth = higher_cutoff - lower_cutoff
-            center_freq    = self.erb2freq(erb_center)
-            q_factor       = center_freq/freq_bandwidth
-            index          = (np.abs(freqs-center_freq)).argmin()
-            
-            self.erb_bands.append(erb_center)
-            self.freq_index.append(index)
-            self.bandwidths.append(freq_bandwidth)
-            self.center_freqs.append(center_freq)
-
-            lower_index  = np.min(np.where(freqs > lower_cutoff))
-            higher_index = np.max(np.where(freqs < higher_cutoff))
-            avg = (self.freq2erb(lower_cutoff) + self.freq2erb(higher_cutoff)) / 2
-            rnge = self.freq2erb(higher_cutoff) - self.freq2erb(lower_cutoff)
-            cos_filts[lower_index:higher_index + 1, erb] = np.cos((self.freq2erb(freqs[lower_index:higher_index + 1]) - avg) / rnge * np.pi)
-            
+        lower_cutoffs  = cutoffs[:total_erb_bands]
+        higher_cutoffs = cutoffs[2:total_erb_bands + 2]  # adjacent filters overlap by 50%
+        lower_erbs     = self.freq2erb(lower_cutoffs)
+        higher_erbs    = self.freq2erb(higher_cutoffs)
+        erb_centers    = (lower_erbs + higher_erbs) / 2
+        erb_ranges     = higher_erbs - lower_erbs
+        center_freqs   = self.erb2freq(erb_centers)
+
+        # index of the frequency closest to each center frequency (the lowest one on ties)
+        right = np.clip(np.searchsorted(freqs, center_freqs), 1, nfreqs)
+        left  = right - 1
+        index = np.where(np.abs(freqs[left] - center_freqs) <= np.abs(freqs[right] - center_freqs), left, right)
+
+        self.erb_bands    = erb_centers.tolist()
+        self.freq_index   = index.tolist()
+        self.bandwidths   = (higher_cutoffs - lower_cutoffs).tolist()
+        self.center_freqs = center_freqs.tolist()
+
+        # first frequency above the lower cutoff and last one below the higher cutoff of each band
+        lower_index  = np.searchsorted(freqs, lower_cutoffs, side='right')
+        higher_index = np.searchsorted(freqs, higher_cutoffs, side='left') - 1
+        # (frequency, band) coordinates of the non zero filter values
+        lengths = np.maximum(higher_index - lower_index + 1, 0)
+        cols = np.repeat(np.arange(total_erb_bands), lengths)
+        rows = np.arange(cols.size) - np.repeat(np.cumsum(lengths) - lengths - lower_index, lengths)
+        values = np.cos((self.freq2erb(freqs[rows]) - erb_centers[cols]) / erb_ranges[cols] * np.pi)
+
         # add lowpass and highpass to get perfect reconstruction
-        filters = np.zeros([nfreqs + 1, total_erb_bands + 2])
-        filters[:, 1:total_erb_bands + 1] = cos_filts
         # lowpass filter goes up to peak of first cos filter
-        higher_index = np.max(np.where(freqs < cutoffs[1]))
-        filters[:higher_index + 1, 0] = np.sqrt(1 - np.power(filters[:higher_index + 1, 1], 2))
+        higher_index = np.searchsorted(freqs, cutoffs[1], side='left') - 1
+        low_rows = np.arange(max(higher_index + 1, 0))
+        low_values = np.sqrt(1 - np.power(self.band_values(rows, cols, values, 0, low_rows), 2))
         # highpass filter goes down to peak of last cos filter
-        lower_index = np.min(np.where(freqs > cutoffs[total_erb_bands]))
-        filters[lower_index:nfreqs + 1, total_erb_bands + 1] = np.sqrt(1 - np.power(filters[lower_index:nfreqs + 1, total_erb_bands], 2))
+        lower_index = np.searchsorted(freqs, cutoffs[total_erb_bands], side='right')
+        high_rows = np.arange(lower_index, nfreqs + 1)
+        high_values = np.sqrt(1 - np.power(self.band_values(rows, cols, values, total_erb_bands - 1, high_rows), 2))
+
+        rows = np.concatenate((low_rows, rows, high_rows))
+        cols = np.concatenate((np.zeros(low_rows.size, dtype=int), cols + 1, np.full(high_rows.size, total_erb_bands + 1)))
+        values = np.concatenate((low_values, values, high_values))
+        shape = (nfreqs + 1, total_erb_bands + 2)
+        if sparse:
+            from scipy.sparse import csc_matrix
+            return csc_matrix((values, (rows, cols)), shape=shape)
+        filters = np.zeros(shape)
+        filters[rows, cols] = values
         return filters
 
+    def band_values(self, rows, cols, values, band, band_rows):
+        """
+        Values of the cos filter of a band at the frequencies band_rows (0 outside of the band)
+        """
+        column = np.zeros(self.nfreqs + 1)
+        in_band = cols == band
+        column[rows[in_band]] = values[in_band]
+        return column[band_rows]
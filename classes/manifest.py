@@ -0,0 +1,123 @@
+"""
+Track manifest of a project (projects/<name>/tracks.json).
+
+Each stem gets a track id the first time it is seen, and keeps it while other stems are added, modified or removed,
+so the ids of the facts and of the exported instances do not depend on the directory order. The ids of removed stems
+are not given again, the ids of a project may have gaps: the tracks are looked up by id, not by position.
+The size, modification time, content hash and duration of each stem are recorded, so a run only hashes
+and analyzes the stems that were added or modified since the previous one.
+"""
+
+import os
+import json
+import tempfile
+from .wav import WavFile
+
+class ProjectManifest(object):
+    """
+    path = directory of the project (e.g. projects/<name>)
+    entries = dict track -> {"id", "size", "mtime", "hash", "duration"}
+    next_id = id of the next new stem
+    added, modified, removed = tracks changed since the manifest was written, set by scan
+    """
+    def __init__(self, path):
+        self.path = path
+        self.file_name = os.path.join(path, "tracks.json")
+        self.entries = {}
+        self.next_id = 1
+        self.added = []
+        self.modified = []
+        self.removed = []
+        if os.path.exists(self.file_name):
+            try:
+                with open(self.file_name) as f:
+                    manifest = json.load(f)
+                self.entries = manifest["tracks"]
+                self.next_id = manifest.get("next_id", 1)
+            except (IOError, OSError, ValueError, KeyError):
+                ## Unreadable manifest, the stems are taken as new
+                self.entries = {}
+        self.next_id = max([self.next_id] + [entry["id"]+1 for entry in self.entries.values()])
+
+    def scan(self):
+        """
+        List the stems of the project and update the entries.
+        Stems whose size and modification time did not change keep their hash and duration.
+        New stems get the next track ids in name order, the other stems keep theirs.
+        """
+        stems = sorted(os.path.splitext(fl)[0] for fl in os.listdir(self.path) if fl.endswith(".wav"))
+        self.added = []
+        self.modified = []
+        self.removed = sorted(track for track in self.entries if track not in stems)
+        for track in self.removed:
+            del self.entries[track]
+
+        for track in stems:
+            stat = os.stat(self.track_file(track))
+            entry = self.entries.get(track)
+            if entry is not None and entry["size"] == stat.st_size and entry["mtime"] == stat.st_mtime:
+                continue
+            if entry is None:
+                self.added.append(track)
+                entry = self.entries[track] = {"id": None}
+            else:
+                self.modified.append(track)
+            entry.update({"size": stat.st_size, "mtime": stat.st_mtime, "hash": None,
+                          "duration": WavFile(self.track_file(track)).duration})
+
+        for track in self.added:
+            self.entries[track]["id"] = self.next_id
+            self.next_id += 1
+        return self.tracks()
+
+    def tracks(self):
+        """
+        Names of the stems in the order of the track ids
+        """
+        return sorted(self.entries, key=lambda track: self.entries[track]["id"])
+
+    def ids(self):
+        """
+        Track ids, in the order of tracks()
+        """
+        return [self.entries[track]["id"] for track in self.tracks()]
+
+    def names(self):
+        """
+        dict track id -> name of the stem
+        """
+        return dict((entry["id"], track) for track, entry in self.entries.items())
+
+    def changed(self):
+        """
+        Stems added or modified since the manifest was written
+        """
+        return self.added + self.modified
+
+    def track_file(self, track):
+        return os.path.join(self.path, "%s.wav"%track)
+
+    def duration(self, track):
+        return self.entries[track]["duration"]
+
+    def use_hashes(self, cache):
+        """
+        Share the content hashes with an analysis cache: known hashes are given to the cache,
+        so unchanged stems are not read again, and the hashes of changed stems are taken from it
+        """
+        for track, entry in self.entries.items():
+            file_name = self.track_file(track)
+            if entry["hash"] is not None:
+                cache.hashes.setdefault(file_name, entry["hash"])
+            else:
+                cache.forget(file_name)
+                entry["hash"] = cache.file_hash(file_name)
+
+    def write(self):
+        """
+        Write the manifest, replacing the previous one at once
+        """
+        handle, tmp = tempfile.mkstemp(dir=self.path, suffix=".tmp")
+        with os.fdopen(handle, "w") as f:
+            json.dump({"tracks": self.entries, "next_id": self.next_id}, f, indent=2, sort_keys=True)
+        os.replace(tmp, self.file_name)
@@ -0,0 +1,50 @@
+"""
+Masking pre-analysis of a project, computed with NumPy from the (tracks x bands) ERB amplitudes.
+
+It follows the first rules of the encodings (lp/eq.lp, lp/eq_opt.lp): essential_band/2, shared_band/2 and
+the mask/3 atoms that can be derived for a masking factor. Exactly one shared band is chosen per answer,
+so without shared bands the program has no answers and clingo does not need to be called.
+Otherwise only the erb_band/3 facts of the tracks and bands of a possible mask/3 atom are needed by the solver.
+"""
+
+import numpy as np
+
+class MaskingIndex(object):
+    """
+    amplitudes = (tracks x bands) amplitudes *100, as in erb_band/3
+    essential = (tracks x bands) essential bands, as essential_band/2
+    shared = (tracks x bands) essential bands shared with another track, as shared_band/2
+    candidates = (maskers x maskees x bands) mask/3 atoms derivable for the masking factor (*100)
+    ids = track id of each row, 1..n if not given
+    """
+    def __init__(self, erbs, threshold, masking_factor, ids=None):
+        erbs = np.asarray(erbs, dtype=float)
+        self.ids = np.arange(1, len(erbs)+1) if ids is None else np.asarray(ids)
+        self.amplitudes = (erbs*100).astype(int)
+        self.essential = erbs >= threshold
+        self.shared = self.essential & (np.sum(self.essential, axis=0) >= 2)[None, :]
+
+        ## Masking coefficient of every masker and maskee per band: 100 - |P1 - P2|
+        coefficient = 100 - np.abs(self.amplitudes[:, None, :] - self.amplitudes[None, :, :])
+        ## Any essential band of the maskee may be chosen as _essential_band/2
+        self.candidates = (coefficient >= masking_factor) & self.essential[None, :, :]
+        tracks = np.arange(len(erbs))
+        self.candidates[tracks, tracks, :] = False
+
+    def conflict(self):
+        """
+        Whether the program can have answers, i.e. at least one band is shared
+        """
+        return bool(np.any(self.shared))
+
+    def masks(self):
+        """
+        Derivable mask/3 atoms as (masker, maskee, band), with the track ids and the bands numbered from 1 as in the facts
+        """
+        return [(int(self.ids[masker]), int(self.ids[maskee]), int(band)+1) for masker, maskee, band in np.argwhere(self.candidates)]
+
+    def involved(self):
+        """
+        (tracks x bands) tracks and bands of the derivable mask/3 atoms, as masker or maskee
+        """
+        return np.any(self.candidates, axis=1) | np.any(self.candidates, axis=0)
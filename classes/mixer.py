@@ -0,0 +1,107 @@
+"""
+Native render engine, an alternative to csound.
+
+The cut/boost filters of the plan are applied as cascades of peaking biquads (the filter of the csound pareq opcode)
+and the tracks are summed into a stereo mixdown. The stems are memory mapped once and shared by all the answers,
+so rendering N mixes costs one read of the stems plus N filter passes, block by block.
+"""
+
+import time
+import threading
+import numpy as np
+from math import pi, sin, cos
+from scipy.signal import sosfilt
+from .wav import WavFile, WavWriter
+from .csd import Renderer
+
+"""
+Second order section of a peaking filter (RBJ audio EQ cookbook) at freq Hz with gain_db dB and quality factor q
+"""
+def peaking_sos(freq, gain_db, q, sr):
+    A = 10**(gain_db/40.0)
+    w0 = 2*pi*freq/sr
+    alpha = sin(w0)/(2*q)
+    a0 = 1 + alpha/A
+    return [(1 + alpha*A)/a0, -2*cos(w0)/a0, (1 - alpha*A)/a0,
+            1.0, -2*cos(w0)/a0, (1 - alpha/A)/a0]
+
+"""
+Cascade of the filters of a track, as given by parse_answer_sets_to_plan: [track, freq, dB, Q]
+"""
+def eq_sos(filters, sr):
+    return np.array([peaking_sos(f[1], f[2], f[3], sr) for f in filters])
+
+class NativeRenderer(Renderer):
+    """
+    Render the mixdowns in the pool of jobs worker threads of csd.Renderer, without csound.
+    track_files = dict track id -> wav file of the track
+    sr = sample rate of the mixdown
+    duration = length of the mixdown in seconds (not rounded, the longest stem is not cut)
+    block = samples filtered at once
+    stems = tracks wrt their ids as functions (start, stop) -> (channels, samples) float block, shared by all the renders
+    """
+    def __init__(self, jobs, track_files, sr, duration, block=1 << 16, timer=None):
+        super(NativeRenderer, self).__init__(jobs, timer)
+        self.track_files = track_files
+        self.sr = int(sr)
+        self.length = int(round(duration*sr))
+        self.block = block
+        self.stems = {}
+        self.stems_lock = threading.Lock()
+
+    def stem(self, track_id):
+        """
+        Track of id track_id, memory mapped. Tracks at another sample rate are resampled only once
+        """
+        with self.stems_lock:
+            if track_id not in self.stems:
+                track = WavFile(self.track_files[track_id])
+                ## At most two channels are used as in the csound instruments
+                if track.sample_rate != self.sr:
+                    from librosa import resample
+                    data = np.array([resample(channel, orig_sr=track.sample_rate, target_sr=self.sr)
+                                     for channel in track.to_float().T[:2]])
+                    self.stems[track_id] = lambda start, stop: data[:, start:stop]
+                else:
+                    self.stems[track_id] = lambda start, stop: track.to_float(start, stop).T[:2]
+            return self.stems[track_id]
+
+    def mixdown(self, wav_file, eqs):
+        """
+        Sum the (equalized) tracks and write the stereo mixdown as a 16 bit wav, the csound default.
+        Tracks are cut or padded with silence to the mixdown length.
+        The mixdown is summed and written one block at a time, so memory does not grow with its length.
+        """
+        sos = dict((track_id, eq_sos(eqs[track_id], self.sr)) for track_id in self.track_files if track_id in eqs)
+        zi = {}
+        writer = WavWriter(wav_file, self.sr, 2, self.length)
+        try:
+            for start in range(0, self.length, self.block):
+                stop = min(start+self.block, self.length)
+                mix = np.zeros((2, stop-start))
+                for track_id in self.track_files:
+                    signal = self.stem(track_id)(start, stop)
+                    if signal.shape[1] == 0:
+                        continue
+                    if track_id in sos:
+                        ## Carry the filter state of each track between blocks
+                        if track_id not in zi:
+                            zi[track_id] = np.zeros((sos[track_id].shape[0], signal.shape[0], 2))
+                        signal, zi[track_id] = sosfilt(sos[track_id], signal, axis=-1, zi=zi[track_id])
+                    ## A mono signal goes to both channels
+                    mix[:, :signal.shape[1]] += signal
+                writer.write(mix.T)
+        finally:
+            writer.close()
+
+    def render(self, path, csound_file, eqs):
+        print("render mixdown to wav: %s"%csound_file)
+        start = time.time()
+        status = 0
+        try:
+            ## Same wav file name as the csound render
+            self.mixdown("%s%s.wav"%(path, csound_file), eqs)
+        except Exception as error:
+            print("render failed for %s: %s"%(csound_file, error))
+            status = 1
+        return csound_file, status, time.time() - start
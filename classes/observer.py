@@ -0,0 +1,33 @@
+"""
+Ground program observers for clingo.
+"""
+
+class ProgramSizeObserver(object):
+    """
+    Count the size of the ground program passed to the solver.
+    rules = number of normal and choice rules
+    weight_rules = number of weight (cardinality) rules
+    atoms = set of the program atoms appearing in any rule
+    """
+    def __init__(self):
+        self.rules = 0
+        self.weight_rules = 0
+        self.atoms = set()
+
+    def rule(self, choice, head, body):
+        self.rules += 1
+        self.atoms.update(head)
+        self.atoms.update(abs(lit) for lit in body)
+
+    def weight_rule(self, choice, head, lower_bound, body):
+        self.weight_rules += 1
+        self.atoms.update(head)
+        self.atoms.update(abs(lit) for lit, _ in body)
+
+    def summary(self):
+        """
+        Size of the ground program as a dict
+        """
+        return {"atoms": len(self.atoms),
+                "rules": self.rules,
+                "weight_rules": self.weight_rules}
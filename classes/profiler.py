@@ -0,0 +1,144 @@
+"""
+Stage timer of the aspeq pipeline: wall time and calls per stage, extra metrics (e.g. clingo statistics),
+and an optional cProfile dump per stage. The report is written as JSON or CSV.
+
+A thread runs one profiler at a time: a nested stage pauses the profile of the enclosing one, so each dump only
+has the time of its own stage. Stages of other threads get a profile (and a dump) of their own.
+"""
+
+import os
+import csv
+import json
+import time
+import cProfile
+import threading
+from contextlib import contextmanager
+
+## Profiles enabled in each thread, the last one is the running one
+active = threading.local()
+
+def enable(profile):
+    """
+    Run profile in the current thread, pausing the running one. Return False if it cannot be enabled
+    (e.g. another profiling tool is active)
+    """
+    stack = active.__dict__.setdefault("profiles", [])
+    if stack:
+        stack[-1].disable()
+    try:
+        profile.enable()
+    except ValueError:
+        if stack:
+            stack[-1].enable()
+        return False
+    stack.append(profile)
+    return True
+
+def disable(profile):
+    """
+    Stop profile and resume the one it paused
+    """
+    profile.disable()
+    stack = active.profiles
+    stack.pop()
+    if stack:
+        stack[-1].enable()
+
+class StageTimer(object):
+    """
+    profile_dir = directory of the cProfile dumps, None = no profiling.
+                  <stage>[_<label>][_<thread>].prof, the thread only for stages run outside of the main thread
+    label = name of the dumps of this timer, e.g. the track analyzed in a worker process
+    stages = dict stage -> {"calls", "time"} in the order the stages first run
+    metrics = dict of extra values of the run
+    profiles = cProfile profile per dump name
+    """
+    def __init__(self, profile_dir=None, label=None):
+        self.profile_dir = profile_dir
+        self.label = label
+        self.stages = {}
+        self.metrics = {}
+        self.profiles = {}
+        self.lock = threading.Lock()
+
+    def add(self, name, elapsed, calls=1):
+        """
+        Add the time of a stage measured elsewhere (e.g. in a worker process or thread)
+        """
+        with self.lock:
+            stage = self.stages.setdefault(name, {"calls": 0, "time": 0.0})
+            stage["calls"] += calls
+            stage["time"] += elapsed
+
+    def dump_name(self, name):
+        """
+        Name of the dump of stage name in the current thread
+        """
+        parts = [name]
+        if self.label is not None:
+            parts.append(self.label)
+        thread = threading.current_thread()
+        if thread is not threading.main_thread():
+            parts.append(thread.name)
+        return "_".join(parts)
+
+    @contextmanager
+    def stage(self, name):
+        """
+        Time (and profile) the body of the with statement as stage name
+        """
+        profile = None
+        with self.lock:
+            self.stages.setdefault(name, {"calls": 0, "time": 0.0})
+            if self.profile_dir is not None:
+                profile = self.profiles.setdefault(self.dump_name(name), cProfile.Profile())
+        if profile is not None and not enable(profile):
+            profile = None
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.add(name, time.time() - start)
+            if profile is not None:
+                disable(profile)
+
+    def metric(self, name, value):
+        with self.lock:
+            self.metrics[name] = value
+
+    def times(self):
+        """
+        Time per stage
+        """
+        with self.lock:
+            return dict((name, stage["time"]) for name, stage in self.stages.items())
+
+    def report(self):
+        with self.lock:
+            return {"stages": dict((name, dict(stage)) for name, stage in self.stages.items()),
+                    "metrics": dict(self.metrics)}
+
+    def write(self, file_name):
+        """
+        Write the report as CSV (stage,calls,time) if file_name ends with .csv, as JSON otherwise
+        """
+        report = self.report()
+        with open(file_name, "w") as f:
+            if file_name.endswith(".csv"):
+                writer = csv.writer(f)
+                writer.writerow(["stage", "calls", "time"])
+                for name, stage in report["stages"].items():
+                    writer.writerow([name, stage["calls"], "%.6f"%stage["time"]])
+            else:
+                json.dump(report, f, indent=2, default=str)
+
+    def dump_profiles(self):
+        """
+        Write the cProfile stats of each stage (and thread) to profile_dir
+        """
+        if self.profile_dir is None:
+            return
+        ## Worker processes may create it at the same time
+        os.makedirs(self.profile_dir, exist_ok=True)
+        for name, profile in self.profiles.items():
+            profile.dump_stats(os.path.join(self.profile_dir, "%s.prof"%name))
@@ -0,0 +1,16 @@
+"""
+Statistics of clingo solve calls, as reported in the summary of a run (see aspeq.run) and summed over the parts
+of a decomposed solving (see decompose.solve).
+"""
+
+"""
+Statistics of the last solve call of a control: models enumerated, solving time, choices and conflicts
+"""
+def solve_statistics(control):
+    statistics = control.statistics
+    summary = statistics.get("summary", {})
+    solvers = statistics.get("solving", {}).get("solvers", {})
+    return {"models": summary.get("models", {}).get("enumerated"),
+            "solve_time": summary.get("times", {}).get("solve"),
+            "choices": solvers.get("choices"),
+            "conflicts": solvers.get("conflicts")}
@@ -0,0 +1,200 @@
+"""
+Memory mapped WAV files.
+
+The RIFF header is parsed once and the data chunk is mapped read-only with numpy, so the analysis and the render
+read the samples straight from the page cache without decoding the whole file into memory.
+Samples are converted to float (and resampled, only if the sample rate differs) block by block when needed.
+Mixdowns are written block by block as well (WavWriter).
+"""
+
+import os
+import struct
+import numpy as np
+
+## WAVE format tags
+PCM = 1
+IEEE_FLOAT = 3
+EXTENSIBLE = 0xFFFE
+
+## Sample types of the data chunk wrt (format tag, bits per sample). 24 bit samples have no numpy type
+DTYPES = {(PCM, 8): np.dtype("u1"),
+          (PCM, 16): np.dtype("<i2"),
+          (PCM, 24): np.dtype("u1"),
+          (PCM, 32): np.dtype("<i4"),
+          (IEEE_FLOAT, 32): np.dtype("<f4"),
+          (IEEE_FLOAT, 64): np.dtype("<f8")}
+
+class WavFile(object):
+    """
+    path = wav file
+    sample_rate, channels, bits, frames, duration = header metadata
+    data = read-only (frames, channels) memory map of the data chunk in the sample type of the file.
+           24 bit samples are mapped as (frames, channels, 3) bytes.
+    """
+    def __init__(self, path):
+        self.path = path
+        fmt, offset, size = self.read_chunks(path)
+        if fmt is None or offset is None:
+            raise ValueError("%s is not a valid WAV file"%path)
+        tag, self.channels, self.sample_rate, _, block_align, self.bits = struct.unpack("<HHIIHH", fmt[:16])
+        if tag == EXTENSIBLE and len(fmt) >= 26:
+            ## The format tag is the start of the sub format GUID
+            tag = struct.unpack("<H", fmt[24:26])[0]
+        if (tag, self.bits) not in DTYPES:
+            raise ValueError("Unsupported WAV format in %s (format %s, %s bits)"%(path, tag, self.bits))
+        self.tag = tag
+        self.frames = size // block_align
+        self.duration = self.frames / float(self.sample_rate)
+
+        shape = (self.frames, self.channels, 3) if self.bits == 24 else (self.frames, self.channels)
+        if self.frames == 0:
+            self.data = np.zeros(shape, dtype=DTYPES[(tag, self.bits)])
+        else:
+            self.data = np.memmap(path, dtype=DTYPES[(tag, self.bits)], mode="r", offset=offset, shape=shape)
+
+    def read_chunks(self, path):
+        """
+        Return the fmt chunk, and the offset and size of the data chunk
+        """
+        file_size = os.path.getsize(path)
+        fmt = None
+        with open(path, "rb") as f:
+            header = f.read(12)
+            if len(header) < 12 or header[:4] != b"RIFF" or header[8:12] != b"WAVE":
+                return None, None, None
+            while True:
+                chunk = f.read(8)
+                if len(chunk) < 8:
+                    return fmt, None, None
+                name, size = struct.unpack("<4sI", chunk)
+                if name == b"fmt ":
+                    fmt = f.read(size)
+                elif name == b"data":
+                    ## Files written while streaming may have a wrong data size
+                    return fmt, f.tell(), min(size, file_size - f.tell())
+                else:
+                    f.seek(size, 1)
+                ## Chunks are word aligned
+                if size % 2:
+                    f.seek(1, 1)
+
+    def to_float(self, start=0, stop=None):
+        """
+        Frames from start to stop as (frames, channels) float32 in [-1, 1]
+        """
+        block = self.data[start:stop]
+        if self.bits == 8:
+            return (block.astype(np.float32) - 128) / 128
+        if self.bits == 24:
+            ## Little endian 3 byte samples, sign extended through the highest byte
+            block = block.astype(np.int32)
+            samples = block[..., 0] | (block[..., 1] << 8) | (block[..., 2] << 16)
+            samples = np.where(samples >= 1 << 23, samples - (1 << 24), samples)
+            return samples.astype(np.float32) / (1 << 23)
+        if self.tag == IEEE_FLOAT:
+            return block.astype(np.float32, copy=False)
+        return block.astype(np.float32) / (1 << (self.bits - 1))
+
+    def mono(self, start=0, stop=None):
+        """
+        Frames from start to stop as mono float32, the average of the channels
+        """
+        return np.mean(self.to_float(start, stop), axis=1, dtype=np.float32)
+
+    def samples(self, sr):
+        """
+        The whole file as mono float32 at sample rate sr
+        """
+        track = self.mono()
+        if self.sample_rate != sr:
+            from librosa import resample
+            track = resample(track, orig_sr=self.sample_rate, target_sr=sr)
+        return track
+
+    def blocks(self, sr, block_length):
+        """
+        Mono float32 blocks of block_length samples at sample rate sr.
+        Files whose sample rate differs from sr cannot be streamed and are resampled at once.
+        """
+        if self.sample_rate != sr:
+            track = self.samples(sr)
+            for start in range(0, len(track), block_length):
+                yield track[start:start+block_length]
+        else:
+            for start in range(0, self.frames, block_length):
+                yield self.mono(start, start+block_length)
+
+    def channel_count(self, mode):
+        """
+        Number of signals of a channel mode (see select)
+        """
+        return self.channels if mode == "max" else 1
+
+    def select(self, mode, start=0, stop=None):
+        """
+        Frames from start to stop as (signals, frames) float32 wrt the channel mode:
+        mid = average of the channels, side = half the difference of the first two channels (silence for mono files),
+        left, right = first or second channel, max = every channel on its own
+        """
+        block = self.to_float(start, stop)
+        if mode == "max":
+            return block.T
+        if mode == "left" or (mode == "right" and self.channels == 1):
+            return block[:, :1].T
+        if mode == "right":
+            return block[:, 1:2].T
+        if mode == "side":
+            if self.channels == 1:
+                return np.zeros((1, block.shape[0]), dtype=np.float32)
+            return ((block[:, 0] - block[:, 1]) / 2)[None, :]
+        return np.mean(block, axis=1, dtype=np.float32)[None, :]
+
+    def channel_blocks(self, sr, block_length, mode="mid", start=0, stop=None):
+        """
+        (signals, samples) float32 blocks of block_length samples at sample rate sr of the frames from start to stop,
+        wrt the channel mode (see select). Only a block is converted to float at a time.
+        If the sample rate differs from sr, the frames from start to stop are resampled at once.
+        """
+        stop = self.frames if stop is None else min(stop, self.frames)
+        if self.sample_rate != sr:
+            from librosa import resample
+            signals = self.select(mode, start, stop)
+            signals = np.array([resample(signal, orig_sr=self.sample_rate, target_sr=sr) for signal in signals])
+            for position in range(0, signals.shape[1], block_length):
+                yield signals[:, position:position+block_length]
+        else:
+            for position in range(start, stop, block_length):
+                yield self.select(mode, position, min(position+block_length, stop))
+
+    def segments(self, max_seconds, segment_seconds):
+        """
+        (start, stop) frames to analyze: the whole file, or if it is longer than max_seconds,
+        evenly spaced segments of segment_seconds adding up to about max_seconds (at least one segment)
+        """
+        if max_seconds <= 0 or self.duration <= max_seconds:
+            return [(0, self.frames)]
+        length = int(min(segment_seconds, max_seconds) * self.sample_rate)
+        count = max(1, int(max_seconds // min(segment_seconds, max_seconds)))
+        starts = np.linspace(0, self.frames - length, count).astype(int)
+        return [(int(start), int(start) + length) for start in starts]
+
+class WavWriter(object):
+    """
+    16 bit PCM wav file written block by block, so a mixdown is never held in memory at full length.
+    The number of frames is known up front and the header is written once.
+    """
+    def __init__(self, path, sample_rate, channels, frames):
+        self.channels = channels
+        self.file = open(path, "wb")
+        data_size = frames * channels * 2
+        self.file.write(struct.pack("<4sI4s4sIHHIIHH4sI", b"RIFF", 36 + data_size, b"WAVE", b"fmt ", 16, PCM, channels,
+                                    sample_rate, sample_rate * channels * 2, channels * 2, 16, b"data", data_size))
+
+    def write(self, block):
+        """
+        Append a (frames, channels) float block in [-1, 1]
+        """
+        self.file.write((np.clip(block, -1, 1) * 32767).astype("<i2").tobytes())
+
+    def close(self):
+        self.file.close()
@@ -0,0 +1,277 @@
+"""
+aspeq service: a long-running local HTTP server for interactive re-equalization.
+
+The ERB amplitudes of the stems and the grounded clingo control objects are kept warm per project,
+so changing the masking factor is only a new solve call. The controls are grounded with one external per
+masking factor (1-99), as a masking factor sweep of aspeq, and a request only switches the externals.
+
+Requests are JSON objects sent with POST:
+/solve    {"project": "demo", "masking_factor": 0.35, "essential_threshold": 0.8, "erb": 40, "erb_weighting": "bin", "samples": 32768,
+           "mixes": 1, "encoding": "default", "optimize": false, "time_limit": 0,
+           "channels": "mid", "max_analysis_seconds": 0, "segment": 10}
+          Only project is required, the other values default to the ones of aspeq.py.
+          Returns the answers with their atoms, plan and EQs per track, and the elapsed time in ms.
+/changed  {"project": "demo", "track": "kick"}
+          A stem changed (or was added/removed): the stems are listed again, the analysis of the changed ones
+          and the controls of the project are dropped. Returns the changed stems.
+/status   {} Projects and warm controls.
+"""
+
+# Imports
+import io
+import os
+import sys
+import json
+import time
+import argparse
+import threading
+from collections import OrderedDict
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+import clingo
+import aspeq
+from classes import audio_features as af
+from classes.cache import AnalysisCache
+from classes.manifest import ProjectManifest
+from classes.masking import MaskingIndex
+
+## Analysis parameters of aspeq
+SR = 44100.0
+LOW_LIM = 20
+HIGH_LIM = SR / 2
+
+## Request values passed on to aspeq's argument parser, so they get its defaults and checks
+OPTIONS = {"samples": "--samples", "erb": "--erb", "erb_weighting": "--erb-weighting", "channels": "--channels",
+           "max_analysis_seconds": "--max-analysis-seconds", "segment": "--segment", "essential_threshold": "--essential-threshold",
+           "masking_factor": "--masking-factor", "mixes": "--mixes", "encoding": "--encoding",
+           "time_limit": "--time-limit", "threads": "--threads"}
+
+class Project(object):
+    """
+    Warm state of a project.
+    tracks = names of the stems, in the order of the track ids of the manifest
+    erbs = ERB amplitudes wrt (track, samples, erb, weighting, channels, max analysis seconds, segment)
+    controls = grounded controls wrt the analysis arguments and (threshold, encoding, optimize, threads), least recently used first.
+               Each one is [control, lock, active masking factor]
+    """
+    def __init__(self, name, cache_size, max_controls):
+        self.name = name
+        self.cache = AnalysisCache("projects/%s/.cache"%name, cache_size*1024*1024) if cache_size > 0 else None
+        self.max_controls = max_controls
+        self.erbs = {}
+        self.controls = OrderedDict()
+        self.lock = threading.Lock()
+        self.manifest = ProjectManifest("projects/%s"%name)
+        self.load_tracks()
+
+    def load_tracks(self):
+        """
+        List the stems with the manifest of the project, return the ones added, modified or removed
+        """
+        self.tracks = self.manifest.scan()
+        self.track_ids = self.manifest.ids()
+        if self.cache is not None:
+            self.manifest.use_hashes(self.cache)
+        self.manifest.write()
+        return self.manifest.changed() + self.manifest.removed
+
+    def track_file(self, track):
+        return "projects/%s/%s"%(self.name, track)
+
+    def erb_bands(self, track, args):
+        """
+        ERB amplitudes of a track wrt the analysis arguments, analyzed on the first request only
+        """
+        N, B = args.samples, args.erb[0]
+        key = (track, N, B, args.erb_weighting, args.channels, args.max_analysis_seconds, args.segment)
+        if key not in self.erbs:
+            _, erb_amps, _ = af.analyze_track(self.track_file(track), SR, N, N, int(N/64), args.stft_batch, [B], LOW_LIM, HIGH_LIM,
+                                              self.cache, args.erb_weighting, args.channels, args.max_analysis_seconds, args.segment)
+            self.erbs[key] = erb_amps[B]
+        return self.erbs[key]
+
+    def control(self, args):
+        """
+        Grounded control wrt the arguments, created on the first request only
+        """
+        key = (args.samples, args.erb[0], args.erb_weighting, args.channels, args.max_analysis_seconds, args.segment,
+               args.essential_threshold, args.encoding, args.optimize, args.threads)
+        with self.lock:
+            if key in self.controls:
+                self.controls.move_to_end(key)
+                return self.controls[key]
+            facts = "".join(af.build_asp_facts(track_id, self.erb_bands(track, args), args.essential_threshold)
+                            for track_id, track in zip(self.track_ids, self.tracks))
+
+        ## Grounding does not need the project lock
+        control = aspeq.create_control(aspeq.clingo_arguments(args), aspeq.ENCODINGS[args.encoding], facts, [],
+                                       list(range(1, 100)), args.optimize)
+        control.ground([("base", []), ("p", [])])
+        entry = [control, threading.Lock(), None]
+
+        with self.lock:
+            entry = self.controls.setdefault(key, entry)
+            self.controls.move_to_end(key)
+            while len(self.controls) > self.max_controls:
+                self.controls.popitem(last=False)
+        return entry
+
+    def solve(self, args):
+        """
+        Solve for each masking factor of args, return the answers
+        """
+        ## Without shared bands there are no answers, nothing is grounded
+        with self.lock:
+            erbs = [self.erb_bands(track, args) for track in self.tracks]
+            names = self.manifest.names()
+        if not erbs or not MaskingIndex(erbs, args.essential_threshold, 1).conflict():
+            return [{"masking_factor": masking_factor, "result": "UNSAT", "proven": None, "answers": []}
+                    for masking_factor in args.masking_factor]
+        entry = self.control(args)
+        control, lock, _ = entry
+        bandwidths, _, center_fr, _, _ = af.get_erb_bank(int(args.samples/2)+1, SR, args.erb[0], LOW_LIM, HIGH_LIM)
+        results = []
+        with lock:
+            control.configuration.solve.models = args.mixes
+            for masking_factor in args.masking_factor:
+                factor = int(masking_factor*100)
+                ## Switch the externals, only the previous factor has to be released
+                if entry[2] is not None:
+                    control.assign_external(clingo.Function("masking_factor", [clingo.Number(entry[2])]), False)
+                control.assign_external(clingo.Function("masking_factor", [clingo.Number(factor)]), True)
+                entry[2] = factor
+
+                answers = []
+                def on_answer(answer):
+                    plan = io.StringIO()
+                    eqs = af.parse_answer_sets_to_plan(plan, names, answer, center_fr, bandwidths)
+                    answers.append({"atoms": [str(atom) for atom in answer], "plan": plan.getvalue(), "eqs": eqs})
+                _, solve_result, proven = aspeq.solve_answers(control, args.time_limit, args.optimize, on_answer)
+                results.append({"masking_factor": masking_factor, "result": str(solve_result),
+                                "proven": proven, "answers": answers})
+        return results
+
+    def changed(self, track):
+        """
+        List the stems of the project again and drop the analysis of the changed ones (at least track),
+        the other stems keep their track ids (also when a stem is removed) and analysis. The controls are dropped, as ground facts cannot be retracted
+        """
+        with self.lock:
+            if self.cache is not None:
+                self.cache.forget(self.track_file(track)+".wav")
+            changed = set(self.load_tracks() + [track])
+            self.erbs = dict((key, erb_amp) for key, erb_amp in self.erbs.items() if key[0] not in changed)
+            self.controls.clear()
+        return sorted(changed)
+
+class Service(object):
+    """
+    Projects of the service, loaded on their first request
+    """
+    def __init__(self, cache_size, max_controls):
+        self.cache_size = cache_size
+        self.max_controls = max_controls
+        self.projects = {}
+        self.lock = threading.Lock()
+
+    def project(self, name):
+        ## Only the existing projects, nothing is created for a mistyped or outside (e.g. ../) name
+        path = os.path.realpath(os.path.join("projects", name))
+        if os.path.dirname(path) != os.path.realpath("projects") or not os.path.isdir(path):
+            raise ValueError("""Unknown project %s"""%name)
+        with self.lock:
+            if name not in self.projects:
+                self.projects[name] = Project(name, self.cache_size, self.max_controls)
+            return self.projects[name]
+
+    def solve(self, request):
+        argv = ["--project=%s"%request["project"]]
+        for name, option in OPTIONS.items():
+            if name in request:
+                value = request[name]
+                if isinstance(value, list):
+                    value = ",".join(str(v) for v in value)
+                argv.append("%s=%s"%(option, value))
+        if request.get("optimize"):
+            argv.append("--optimize")
+        args = aspeq.parse_params(argv)
+        aspeq.check_input(args)
+        if len(args.erb) > 1:
+            raise ValueError("""A request is solved for a single number of erb bands""")
+        start = time.time()
+        results = self.project(args.project).solve(args)
+        return {"results": results, "time": (time.time() - start)*1000}
+
+    def changed(self, request):
+        return {"changed": self.project(request["project"]).changed(request["track"])}
+
+    def status(self, request):
+        with self.lock:
+            projects = list(self.projects.values())
+        return {"projects": dict((project.name, {"tracks": project.tracks, "controls": [list(key) for key in project.controls]})
+                                 for project in projects)}
+
+class Handler(BaseHTTPRequestHandler):
+    """
+    JSON requests to the service. Errors in the request are answered with 400 and the message
+    """
+    def do_POST(self):
+        routes = {"/solve": self.server.service.solve,
+                  "/changed": self.server.service.changed,
+                  "/status": self.server.service.status}
+        if self.path not in routes:
+            self.reply(404, {"error": "Unknown request %s"%self.path})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            request = json.loads(self.rfile.read(length).decode("utf-8") or "{}")
+            self.reply(200, routes[self.path](request))
+        except SystemExit:
+            ## argparse exits on invalid values
+            self.reply(400, {"error": "Invalid arguments"})
+        except (ValueError, KeyError, OSError) as error:
+            self.reply(400, {"error": str(error)})
+
+    def reply(self, status, body):
+        data = json.dumps(body).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+"""
+Parse Arguments
+"""
+def parse_params():
+    parser = argparse.ArgumentParser(prog='server.py',
+                                     description="Run aspeq as a local service with warm analysis and grounding.")
+    parser.add_argument("--host", type=str, default="127.0.0.1",
+                        help="Address to listen on. Default: 127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765,
+                        help="Port to listen on. Default: 8765")
+    parser.add_argument("--cache-size", type=int, default=512,
+                        help="Size in MB of the analysis cache of each project. Default: 512. 0 = cache off")
+    parser.add_argument("--max-controls", type=int, default=8,
+                        help="Grounded controls kept per project. Default: 8")
+    return parser.parse_args()
+
+"""
+Main function
+"""
+def main():
+    args = parse_params()
+    server = ThreadingHTTPServer((args.host, args.port), Handler)
+    server.service = Service(args.cache_size, args.max_controls)
+    print("aspeq service on http://%s:%s"%(args.host, args.port))
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    server.server_close()
+
+
+"""
+Main function
+"""
+if __name__ == '__main__':
+    sys.exit(main())
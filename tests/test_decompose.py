@@ -0,0 +1,61 @@
+"""
+Decomposed solving (classes/decompose.py) with mixes=0 combines the answers of the parts into the same answer sets
+as the whole program
+"""
+
+import os
+import pytest
+
+clingo = pytest.importorskip("clingo")
+
+import aspeq
+import benchmark_suite
+from classes import audio_features as af
+from classes import decompose
+from classes.masking import MaskingIndex
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+THRESHOLD = 0.8
+
+def whole_answers(encoding, facts, masking_factor):
+    """
+    All the answer sets of the whole program, as sets of the shown atoms
+    """
+    control = clingo.Control(["0", "--warn=none"])
+    control.load(os.path.join(ROOT, encoding))
+    control.add("base", [], facts + "masking_factor(%s)."%masking_factor)
+    control.ground([("base", [])])
+    answers = []
+    control.solve(on_model=lambda model: answers.append(frozenset(str(atom) for atom in model.symbols(shown=True))))
+    return answers
+
+def assert_same_answers(erbs, masking_factor, encoding="default", jobs=1, ids=None):
+    index = MaskingIndex(erbs, THRESHOLD, masking_factor, ids)
+    facts = "".join(af.build_asp_facts(index.ids[i], erb_bands, THRESHOLD) for i, erb_bands in enumerate(erbs))
+    whole = whole_answers(aspeq.ENCODINGS[encoding], facts, masking_factor)
+
+    combined = []
+    answers, exhausted, statistics = decompose.solve(lambda: ["--warn=none"], os.path.join(ROOT, aspeq.ENCODINGS[encoding]),
+                                                     index, masking_factor, 0, jobs,
+                                                     lambda answer: combined.append(frozenset(str(atom) for atom in answer)))
+    assert answers == len(combined)
+    assert exhausted
+    ## Each combination is a distinct answer set
+    assert len(combined) == len(set(combined))
+    assert set(combined) == set(whole)
+    return combined
+
+@pytest.mark.parametrize("encoding", ["default", "optimized"])
+@pytest.mark.parametrize("tracks,bands,seed,masking_factor", [
+    (2, 6, 8, 50), (3, 6, 6, 80), (3, 10, 4, 50), (4, 8, 3, 50), (4, 8, 1, 80), (5, 6, 1, 80)])
+def test_synthetic(encoding, tracks, bands, seed, masking_factor):
+    assert assert_same_answers(benchmark_suite.synthetic_erbs(tracks, bands, THRESHOLD, seed), masking_factor, encoding)
+
+def test_parallel_parts_with_id_gaps():
+    ## The parts solved in processes, for the track ids of a project where stems were removed
+    erbs = benchmark_suite.synthetic_erbs(4, 8, THRESHOLD, 3)
+    assert assert_same_answers(erbs, 50, jobs=2, ids=[2, 3, 5, 9])
+
+def test_synthetic_without_shared_bands():
+    erbs = benchmark_suite.synthetic_erbs(2, 5, THRESHOLD, 1)
+    assert assert_same_answers(erbs, 50) == []
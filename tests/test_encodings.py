@@ -0,0 +1,53 @@
+"""
+The grounding optimized encoding (lp/eq_opt.lp) has the same answer sets as lp/eq.lp on mask/3, cut/5 and boost/5
+"""
+
+import os
+import pytest
+
+clingo = pytest.importorskip("clingo")
+
+import aspeq
+import benchmark_suite
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEMO = ["bass", "hihats_mono", "kick", "snare"]
+
+def projected_answers(encoding, facts, masking_factor):
+    """
+    All the answer sets of an encoding, projected on mask/3, cut/5 and boost/5
+    """
+    control = clingo.Control(["0", "--warn=none"])
+    control.load(os.path.join(ROOT, encoding))
+    control.add("base", [], facts + "masking_factor(%s)."%masking_factor)
+    control.ground([("base", [])])
+    answers = []
+    control.solve(on_model=lambda model: answers.append(frozenset(
+        str(atom) for atom in model.symbols(atoms=True) if atom.name in ("mask", "cut", "boost"))))
+    return answers
+
+def assert_same_answers(facts, masking_factor):
+    default = projected_answers(aspeq.ENCODINGS["default"], facts, masking_factor)
+    optimized = projected_answers(aspeq.ENCODINGS["optimized"], facts, masking_factor)
+    assert len(default) == len(optimized)
+    assert set(default) == set(optimized)
+    return default
+
+@pytest.mark.parametrize("masking_factor", [30, 50, 80])
+def test_demo(masking_factor):
+    facts = ""
+    for track in DEMO:
+        with open(os.path.join(ROOT, "projects", "demo", "%s.lp"%track)) as f:
+            facts += f.read()
+    assert assert_same_answers(facts, masking_factor)
+
+@pytest.mark.parametrize("tracks,bands,seed,masking_factor", [
+    (2, 6, 8, 50), (3, 6, 6, 80), (3, 10, 4, 50), (4, 8, 3, 50), (4, 8, 1, 80), (5, 6, 1, 80)])
+def test_synthetic(tracks, bands, seed, masking_factor):
+    erbs = benchmark_suite.synthetic_erbs(tracks, bands, 0.8, seed)
+    assert assert_same_answers(benchmark_suite.synthetic_instance(erbs, 0.8), masking_factor)
+
+def test_synthetic_without_shared_bands():
+    ## No band is shared, neither encoding has answers
+    erbs = benchmark_suite.synthetic_erbs(2, 5, 0.8, 1)
+    assert assert_same_answers(benchmark_suite.synthetic_instance(erbs, 0.8), 50) == []
@@ -0,0 +1,64 @@
+"""
+The vectorized filter bank matches the original loop over the bands, dense and sparse
+"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+
+from classes import erb
+from classes import audio_features as af
+
+PARAMETERS = [(16385, 40), (16385, 100), (2049, 20), (513, 10), (16384, 3), (4097, 1)]
+
+def loop_bank(bank):
+    """
+    Filters, indexes and bandwidths as computed band by band before the vectorization
+    """
+    total_erb_bands, nfreqs, freqs, cutoffs = bank.total_erb_bands, bank.nfreqs, bank.freqs, bank.cutoffs
+    freq_index, bandwidths, center_freqs = [], [], []
+    cos_filts = np.zeros([nfreqs + 1, total_erb_bands])
+    for band in range(total_erb_bands):
+        lower_cutoff = cutoffs[band]
+        higher_cutoff = cutoffs[band + 2]
+        erb_center = (bank.freq2erb(lower_cutoff) + bank.freq2erb(higher_cutoff)) / 2
+        center_freq = bank.erb2freq(erb_center)
+        freq_index.append((np.abs(freqs-center_freq)).argmin())
+        bandwidths.append(higher_cutoff - lower_cutoff)
+        center_freqs.append(center_freq)
+        lower_index = np.min(np.where(freqs > lower_cutoff))
+        higher_index = np.max(np.where(freqs < higher_cutoff))
+        rnge = bank.freq2erb(higher_cutoff) - bank.freq2erb(lower_cutoff)
+        cos_filts[lower_index:higher_index + 1, band] = np.cos((bank.freq2erb(freqs[lower_index:higher_index + 1]) - erb_center) / rnge * np.pi)
+    filters = np.zeros([nfreqs + 1, total_erb_bands + 2])
+    filters[:, 1:total_erb_bands + 1] = cos_filts
+    higher_index = np.max(np.where(freqs < cutoffs[1]))
+    filters[:higher_index + 1, 0] = np.sqrt(1 - np.power(filters[:higher_index + 1, 1], 2))
+    lower_index = np.min(np.where(freqs > cutoffs[total_erb_bands]))
+    filters[lower_index:nfreqs + 1, total_erb_bands + 1] = np.sqrt(1 - np.power(filters[lower_index:nfreqs + 1, total_erb_bands], 2))
+    return filters, freq_index, bandwidths, center_freqs
+
+@pytest.mark.parametrize("len_signal,bands", PARAMETERS)
+def test_filter_bank(len_signal, bands):
+    bank = erb.EquivalentRectangularBandwidth(len_signal, 44100.0, bands, 20, 22050.0)
+    filters, freq_index, bandwidths, center_freqs = loop_bank(bank)
+    assert np.array_equal(bank.filters, filters)
+    assert bank.freq_index == freq_index
+    assert bank.bandwidths == bandwidths
+    assert bank.center_freqs == center_freqs
+
+@pytest.mark.parametrize("len_signal,bands", PARAMETERS)
+def test_sparse_filter_bank(len_signal, bands):
+    pytest.importorskip("scipy")
+    dense = erb.EquivalentRectangularBandwidth(len_signal, 44100.0, bands, 20, 22050.0)
+    sparse = erb.EquivalentRectangularBandwidth(len_signal, 44100.0, bands, 20, 22050.0, True)
+    assert sparse.filters.format == "csc"
+    assert np.array_equal(sparse.filters.toarray(), dense.filters)
+
+@pytest.mark.parametrize("weighting", ["bin", "energy"])
+def test_sparse_erb_bands(weighting):
+    pytest.importorskip("scipy")
+    spectrum = np.random.RandomState(0).uniform(size=2049)
+    dense, _, _, _, _ = af.get_erb_bands(spectrum, len(spectrum), 44100.0, 40, 20, 22050.0, weighting)
+    sparse, _, _, _, _ = af.get_erb_bands(spectrum, len(spectrum), 44100.0, 40, 20, 22050.0, weighting, True)
+    assert np.allclose(dense, sparse, rtol=1e-12, atol=0)
@@ -0,0 +1,79 @@
+"""
+The masking pre-analysis (classes/masking.py) does not change the answers:
+the facts pruned to the bands of the possible masks have the same answer sets as the full facts
+"""
+
+import os
+import re
+import pytest
+
+clingo = pytest.importorskip("clingo")
+
+import aspeq
+import benchmark_suite
+from classes import audio_features as af
+from classes.masking import MaskingIndex
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEMO = ["bass", "hihats_mono", "kick", "snare"]
+THRESHOLD = 0.8
+
+def demo_erbs():
+    """
+    ERB amplitudes of the demo tracks, read back from their instances (amplitude *100)
+    """
+    erbs = []
+    for track in DEMO:
+        with open(os.path.join(ROOT, "projects", "demo", "%s.lp"%track)) as f:
+            bands = dict((int(band), int(amplitude)) for band, amplitude in re.findall(r"^erb_band\(\d+,(\d+),(\d+)\)\.", f.read(), re.M))
+        ## Half a unit above, so *100 gives the same integer amplitude back
+        erbs.append([(bands[band]+0.5)/100 for band in sorted(bands)])
+    return erbs
+
+def shown_answers(encoding, facts, masking_factor):
+    """
+    All the answer sets of an encoding, as sets of the shown atoms
+    """
+    control = clingo.Control(["0", "--warn=none"])
+    control.load(os.path.join(ROOT, encoding))
+    control.add("base", [], facts + "masking_factor(%s)."%masking_factor)
+    control.ground([("base", [])])
+    answers = []
+    control.solve(on_model=lambda model: answers.append(frozenset(str(atom) for atom in model.symbols(shown=True))))
+    return answers
+
+def assert_same_answers(erbs, masking_factor, ids=None):
+    index = MaskingIndex(erbs, THRESHOLD, masking_factor, ids)
+    ids = index.ids
+    full = "".join(af.build_asp_facts(ids[i], erb_bands, THRESHOLD) for i, erb_bands in enumerate(erbs))
+    involved = index.involved()
+    pruned = "".join(af.build_asp_facts(ids[i], erb_bands, THRESHOLD, involved[i]) for i, erb_bands in enumerate(erbs))
+    assert len(pruned) <= len(full)
+    for encoding in sorted(aspeq.ENCODINGS):
+        full_answers = shown_answers(aspeq.ENCODINGS[encoding], full, masking_factor)
+        pruned_answers = shown_answers(aspeq.ENCODINGS[encoding], pruned, masking_factor)
+        assert len(full_answers) == len(pruned_answers)
+        assert set(full_answers) == set(pruned_answers)
+        ## No answer without a shared band, and only the masks found by the index
+        assert bool(full_answers) == index.conflict()
+        masks = set("mask(%d,%d,%d)"%mask for mask in index.masks())
+        assert set(atom for answer in full_answers for atom in answer if atom.startswith("mask(")) <= masks
+    return full_answers
+
+@pytest.mark.parametrize("masking_factor", [30, 50, 80])
+def test_demo(masking_factor):
+    assert assert_same_answers(demo_erbs(), masking_factor)
+
+def test_demo_ids_with_gaps():
+    ## Track ids of a project where stems were removed
+    assert assert_same_answers(demo_erbs(), 50, [1, 3, 4, 7])
+
+@pytest.mark.parametrize("tracks,bands,seed,masking_factor", [
+    (2, 6, 8, 50), (3, 6, 6, 80), (3, 10, 4, 50), (4, 8, 3, 50), (4, 8, 1, 80), (5, 6, 1, 80)])
+def test_synthetic(tracks, bands, seed, masking_factor):
+    assert assert_same_answers(benchmark_suite.synthetic_erbs(tracks, bands, THRESHOLD, seed), masking_factor)
+
+def test_synthetic_without_shared_bands():
+    erbs = benchmark_suite.synthetic_erbs(2, 5, THRESHOLD, 1)
+    assert not MaskingIndex(erbs, THRESHOLD, 50).conflict()
+    assert assert_same_answers(erbs, 50) == []
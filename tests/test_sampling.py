@@ -0,0 +1,73 @@
+"""
+XOR sampling (classes/count_propagator.py): repeated steps give distinct answer sets of the plain enumeration
+"""
+
+import os
+import pytest
+
+clingo = pytest.importorskip("clingo")
+
+import aspeq
+from classes.count_propagator import Propagator, sample
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+DEMO = ["bass", "hihats_mono", "kick", "snare"]
+MASKING_FACTOR = 20
+
+def demo_control(arguments):
+    control = clingo.Control(arguments + ["--warn=none"])
+    control.load(os.path.join(ROOT, aspeq.ENCODINGS["default"]))
+    for track in DEMO:
+        control.load(os.path.join(ROOT, "projects", "demo", "%s.lp"%track))
+    control.add("base", [], "masking_factor(%s)."%MASKING_FACTOR)
+    control.ground([("base", [])])
+    return control
+
+def answer_key(answer):
+    return frozenset(str(atom) for atom in answer)
+
+def enumerated_answers():
+    control = demo_control(["0"])
+    answers = set()
+    control.solve(on_model=lambda model: answers.add(answer_key(model.symbols(shown=True))))
+    return answers
+
+class FirstCellEmpty(Propagator):
+    """
+    Sampler whose first step draws inconsistent constraints: without atoms, some of the 20 rows are 0 = 1
+    """
+    def __init__(self, *args, **kwargs):
+        super(FirstCellEmpty, self).__init__(*args, **kwargs)
+        self.steps = 0
+
+    def init(self, init):
+        s, q = self.s, self.q
+        if self.steps == 0:
+            self.s, self.q = 20, 0
+        super(FirstCellEmpty, self).init(init)
+        self.s, self.q = s, q
+        self.steps += 1
+
+def run_sampler(propagator, mixes):
+    control = demo_control(["--sign-def=rnd", "--seed=1"])
+    control.register_propagator(propagator)
+    samples = []
+    found = sample(control, mixes, on_model=lambda answer: samples.append(answer_key(answer)))
+    return found, samples
+
+@pytest.mark.parametrize("s", [1, 2, 4])
+@pytest.mark.parametrize("seed", [1, 2, 3])
+def test_distinct_samples(s, seed):
+    answers = enumerated_answers()
+    mixes = 10
+    assert len(answers) >= mixes
+    found, samples = run_sampler(Propagator(s, 0.5, seed=seed), mixes)
+    assert found == mixes
+    assert len(set(samples)) == mixes
+    assert set(samples) <= answers
+
+def test_empty_cell_is_not_kept():
+    ## The conflict of an inconsistent step does not remain for the next ones
+    found, samples = run_sampler(FirstCellEmpty(2, 0.5, seed=1), 3)
+    assert found == 3
+    assert set(samples) <= enumerated_answers()
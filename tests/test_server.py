@@ -0,0 +1,110 @@
+"""
+Drive the aspeq service with a local client on a copy of the demo project
+"""
+
+import os
+import json
+import shutil
+import threading
+import pytest
+
+pytest.importorskip("clingo")
+pytest.importorskip("librosa")
+
+from http.client import HTTPConnection
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+@pytest.fixture
+def service(tmp_path, monkeypatch):
+    ## The service works on projects/ and lp/ of the working directory
+    os.makedirs(str(tmp_path / "projects" / "demo"))
+    for fl in os.listdir(os.path.join(ROOT, "projects", "demo")):
+        if fl.endswith(".wav"):
+            shutil.copy(os.path.join(ROOT, "projects", "demo", fl), str(tmp_path / "projects" / "demo"))
+    os.symlink(os.path.join(ROOT, "lp"), str(tmp_path / "lp"))
+    monkeypatch.chdir(str(tmp_path))
+
+    import server
+    httpd = server.ThreadingHTTPServer(("127.0.0.1", 0), server.Handler)
+    httpd.service = server.Service(0, 2)
+    thread = threading.Thread(target=httpd.serve_forever)
+    thread.daemon = True
+    thread.start()
+    yield httpd.server_address[1]
+    httpd.shutdown()
+    httpd.server_close()
+
+def post(port, path, body):
+    connection = HTTPConnection("127.0.0.1", port, timeout=300)
+    connection.request("POST", path, json.dumps(body), {"Content-Type": "application/json"})
+    response = connection.getresponse()
+    reply = json.loads(response.read().decode("utf-8"))
+    connection.close()
+    return response.status, reply
+
+def test_solve(service):
+    status, reply = post(service, "/solve", {"project": "demo", "masking_factor": [0.5, 0.3], "mixes": 2})
+    assert status == 200
+    assert [result["masking_factor"] for result in reply["results"]] == [0.5, 0.3]
+    for result in reply["results"]:
+        ## kick and bass share the first band
+        assert result["result"] == "SAT"
+        assert 1 <= len(result["answers"]) <= 2
+        for answer in result["answers"]:
+            assert any(atom.startswith("_essential_band(") for atom in answer["atoms"])
+            assert set(answer["eqs"]) <= set(["1", "2", "3", "4"])
+
+def test_solve_warm(service):
+    post(service, "/solve", {"project": "demo", "masking_factor": 0.5})
+    status, reply = post(service, "/solve", {"project": "demo", "masking_factor": 0.35})
+    assert status == 200
+    assert reply["results"][0]["result"] == "SAT"
+    ## Both masking factors share the grounded control
+    status, reply = post(service, "/status", {})
+    assert status == 200
+    assert reply["projects"]["demo"]["tracks"] == ["bass", "hihats_mono", "kick", "snare"]
+    assert len(reply["projects"]["demo"]["controls"]) == 1
+
+def test_changed(service):
+    post(service, "/solve", {"project": "demo"})
+    status, reply = post(service, "/changed", {"project": "demo", "track": "kick"})
+    assert status == 200
+    assert reply["changed"] == ["kick"]
+    status, reply = post(service, "/status", {})
+    assert reply["projects"]["demo"]["controls"] == []
+
+    ## A removed stem is reported, the other stems keep their track ids
+    os.remove(os.path.join("projects", "demo", "hihats_mono.wav"))
+    status, reply = post(service, "/changed", {"project": "demo", "track": "hihats_mono"})
+    assert status == 200
+    assert reply["changed"] == ["hihats_mono"]
+    status, reply = post(service, "/status", {})
+    assert reply["projects"]["demo"]["tracks"] == ["bass", "kick", "snare"]
+    with open(os.path.join("projects", "demo", "tracks.json")) as f:
+        entries = json.load(f)["tracks"]
+    assert dict((track, entry["id"]) for track, entry in entries.items()) == {"bass": 1, "kick": 3, "snare": 4}
+    ## The answers name the stems by their kept ids
+    status, reply = post(service, "/solve", {"project": "demo"})
+    assert status == 200
+    for answer in reply["results"][0]["answers"]:
+        assert set(int(track) for track in answer["eqs"]) <= {1, 3, 4}
+        assert "hihats_mono" not in answer["plan"]
+
+@pytest.mark.parametrize("project", ["nope", "../demo", "demo/../../x"])
+def test_unknown_project(service, project):
+    status, reply = post(service, "/solve", {"project": project})
+    assert status == 400
+    assert "Unknown project" in reply["error"]
+    status, reply = post(service, "/changed", {"project": project, "track": "kick"})
+    assert status == 400
+    assert sorted(os.listdir("projects")) == ["demo"]
+    assert not os.path.exists("x")
+
+def test_invalid_request(service):
+    status, _ = post(service, "/solve", {"project": "demo", "masking_factor": 2})
+    assert status == 400
+    status, _ = post(service, "/solve", {"project": "demo", "encoding": "unknown"})
+    assert status == 400
+    status, _ = post(service, "/unknown", {})
+    assert status == 404
@@ -0,0 +1,47 @@
+"""
+The streaming spectrum matches the one of librosa's stft (zero padded since librosa 0.10).
+librosa transforms the float32 samples, so they agree up to float32 precision.
+"""
+
+import pytest
+
+np = pytest.importorskip("numpy")
+pytest.importorskip("librosa")
+wavfile = pytest.importorskip("scipy.io.wavfile")
+
+from classes import audio_features as af
+
+SR = 44100.0
+
+def write_track(path, samples, channels, sample_rate=44100):
+    rnd = np.random.RandomState(samples + channels)
+    data = (rnd.uniform(-0.5, 0.5, (samples, channels)).squeeze()*32767).astype(np.int16)
+    wavfile.write(path + ".wav", sample_rate, data)
+    return path
+
+@pytest.mark.parametrize("samples,channels,N,batch", [
+    (44100, 1, 4096, 1), (44100, 2, 4096, 7), (50000, 2, 2048, 64),
+    (1000, 1, 4096, 4), (4096*3+17, 2, 4096, 1000)])
+@pytest.mark.filterwarnings("ignore:n_fft")
+def test_streaming_spectrum(tmp_path, samples, channels, N, batch):
+    track = write_track(str(tmp_path / "track"), samples, channels)
+    spectrum, length = af.get_spectrum(track, SR, N, N, N//64)
+    streamed, streamed_length = af.get_spectrum(track, SR, N, N, N//64, batch)
+    assert length == streamed_length == N//2 + 1
+    assert np.allclose(spectrum, streamed, rtol=1e-6, atol=1e-8)
+
+def test_streaming_spectrum_resampled(tmp_path):
+    track = write_track(str(tmp_path / "track"), 22050, 2, 22050)
+    spectrum, _ = af.get_spectrum(track, SR, 4096, 4096, 64)
+    streamed, _ = af.get_spectrum(track, SR, 4096, 4096, 64, 16)
+    assert np.allclose(spectrum, streamed, rtol=1e-6, atol=1e-8)
+
+def test_silent_side(tmp_path):
+    ## Identical channels have no side signal, the spectrum stays at zero
+    path = str(tmp_path / "track")
+    data = (np.random.RandomState(0).uniform(-0.5, 0.5, 20000)*32767).astype(np.int16)
+    wavfile.write(path + ".wav", 44100, np.stack((data, data), axis=1))
+    spectrum, _ = af.get_spectrum(path, SR, 2048, 2048, 32, channels="side")
+    assert not np.any(spectrum)
+    erb_amp, _, _, _, _ = af.get_erb_bands(spectrum, len(spectrum), SR, 20, 20, SR/2, "energy")
+    assert not np.any(erb_amp)
@@ -0,0 +1,18 @@
+"""
+Startup of a solve-only run: importing aspeq does not import librosa, matplotlib or scipy
+"""
+
+import pytest
+
+pytest.importorskip("clingo")
+pytest.importorskip("numpy")
+
+import benchmark_suite
+
+## Seconds to import aspeq: about 0.1 with numpy and clingo only, the librosa functions alone take over 1
+STARTUP_BOUND = 1.0
+
+def test_startup():
+    result = benchmark_suite.bench_startup()
+    assert result["heavy_modules"] == []
+    assert result["import_time"] < STARTUP_BOUND